@@ -8,16 +8,20 @@
 
 # Standard Python modules
 import os
-from os import listdir
-from os.path import isfile, isdir, join
+from os.path import isfile, join
 from urllib.parse import urlparse,quote, unquote
 
 import re
+import fnmatch
 from itertools import islice
+from functools import lru_cache
+from collections import deque
 import csv
+import hashlib
+import signal
 
-# Data Frames
-import pandas as pd
+# Data Frames (pandas) and PDF parsing (pdfminer) are imported by the
+# functions that use them, so that importing this module stays cheap.
 
 #*******************************************************************************************
 # Part 1: Files, Paths, Directories, Readers, Writers & Parsers
@@ -27,11 +31,16 @@ import pandas as pd
 # File Tools
 #-------------------------------------------------------------------------------------------
 
+# os.scandir reports the entry type from the directory listing itself, so
+# (unlike listdir + isfile/isdir) no extra stat call is made per entry.
+
 def files_in_dir(dir):
-    return [join(dir, f) for f in listdir(dir) if isfile(join(dir, f))]
+    with os.scandir(dir) as entries:
+        return [entry.path for entry in entries if entry.is_file()]
 
 def dirs_in_dir(dir):
-    return [join(dir, f) for f in listdir(dir) if isdir(join(dir, f))]
+    with os.scandir(dir) as entries:
+        return [entry.path for entry in entries if entry.is_dir()]
 
 #-------------------------------------------------------------------------------------------
 # Pathname Name Tools
@@ -51,29 +60,109 @@ def make_sub_filename(output_file, postfix_name, ext='csv'):
 # Loadind and Saving text files
 #-------------------------------------------------------------------------------------------
 
-def load_text_file (file, encoding='utf-8'):
-    f = open(file, 'r',  encoding='utf-8')
-    text = f.read()
-    f.close()
-    return text
+text_buffer_size = 1 << 20
+
+# With <mapped> the file is memory-mapped and decoded straight from the
+# mapping, without an intermediate read buffer.
+
+def load_text_file (file, encoding='utf-8', mapped=False):
+    if mapped:
+        with MappedTextFile(file, encoding) as m:
+            return m.text()
+    with open(file, 'r', encoding=encoding) as f:
+        return f.read()
 
 #-------------------------------------------------------------------------------------------
 
-# Returns a list with the text content of each file. Tex
+# Read-only memory map of a text file. Nothing is decoded until asked for:
+# text(start, stop) decodes a byte range, lines() decodes one line at a
+# time, and the raw bytes are available as .data (e.g. for find or re on
+# bytes patterns). Use it as a context manager.
+
+class MappedTextFile:
+
+    def __init__(self, file, encoding='utf-8', errors='strict'):
+        import mmap
+        self.file = file
+        self.encoding = encoding
+        self.errors = errors
+        self.handle = open(file, 'rb')
+        size = os.fstat(self.handle.fileno()).st_size
+        # Empty files cannot be mapped.
+        if size == 0:
+            self.data = b''
+        else:
+            self.data = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
 
-def load_text_directory(dir):
-    files = files_in_dir(dir)
-    return [load_text_file(f) for f in files]
+    def __len__(self):
+        return len(self.data)
+
+    def text(self, start=0, stop=None):
+        return str(self.data[start:stop], self.encoding, self.errors)
+
+    def lines(self, keepends=True):
+        start = 0
+        size = len(self.data)
+        while start < size:
+            end = self.data.find(b'\n', start)
+            end = size if end == -1 else end + 1
+            line = str(self.data[start:end], self.encoding, self.errors)
+            yield line if keepends else line.rstrip('\r\n')
+            start = end
+
+    def close(self):
+        if not isinstance(self.data, bytes):
+            self.data.close()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 #-------------------------------------------------------------------------------------------
 
-# Python 3.6 supposedly handles unicode natively. We'll see. 
+# Yields the lines (mode='lines') or successive chunks of about
+# <buffer_size> characters (mode='chunks') of a text file, reading through
+# a <buffer_size> buffer.
+
+def iter_text_file (file, mode='lines', encoding='utf-8', buffer_size=text_buffer_size):
+    with open(file, 'r', encoding=encoding, buffering=buffer_size) as f:
+        if mode == 'chunks':
+            while True:
+                chunk = f.read(buffer_size)
+                if not chunk:
+                    return
+                yield chunk
+        else:
+            yield from f
+
+#-------------------------------------------------------------------------------------------
+
+# Yields (path, text) for the files of <dir>, one file in memory at a time.
+# See walk_files for the filters.
+
+def iter_text_directory (dir, encoding='utf-8', recursive=False, pattern=None,
+                         extensions=None, mapped=False):
+    for f in walk_files(dir, recursive, pattern, extensions):
+        yield f, load_text_file(f, encoding, mapped)
+
+#-------------------------------------------------------------------------------------------
+
+# Returns a list with the text content of each file.
+
+def load_text_directory(dir, encoding='utf-8'):
+    return [text for f, text in iter_text_directory(dir, encoding)]
+
+#-------------------------------------------------------------------------------------------
+
+# Writes <lines> (which already carry their line terminators) in bulk
+# through a <buffer_size> buffer.
 
-def save_text_file (lines, file):
-    f = open(file,'w', encoding='utf-8')
-    for line in lines:
-        f.write(line)
-    f.close()
+def save_text_file (lines, file, encoding='utf-8', buffer_size=text_buffer_size):
+    with open(file, 'w', encoding=encoding, buffering=buffer_size) as f:
+        f.writelines(lines)
     return True
 
 #-------------------------------------------------------------------------------------------
@@ -97,49 +186,76 @@ def save_text_file (lines, file):
 # of strings.
 
 def quoted_field_p (field):
-    return (field[1]=='"') and (field[-1]=='"')
+    return len(field) > 1 and (field[0]=='"') and (field[-1]=='"')
 
 #-------------------------------------------------------------------------------------------
 
-def load_csv_file (file, mode='rows', encoding='utf-8'):
-    rows = []
-    with open(file, mode='rU', encoding=encoding) as csvfile:
-        freader = csv.reader(csvfile, delimiter=',', quotechar='|')
+# Yields the rows of a CSV file one at a time, or lists of up to <chunksize>
+# of them. In mode 'text' the fields of each row are yielded individually,
+# with surrounding quotes stripped, as load_csv_file does. Quotes default to
+# '|', as written by save_csv_file; pass quotechar='"' for standard CSV.
+
+def iter_csv_file (file, mode='rows', encoding='utf-8', chunksize=None, quotechar='|'):
+    with open(file, mode='r', newline='', encoding=encoding) as csvfile:
+        freader = csv.reader(csvfile, delimiter=',', quotechar=quotechar)
         count = 0
-        if mode=='text':
-            try:
-                for row in freader:
-                    row = [field[1 : -1] if quoted_field_p(field) else field for field in row ]
-                    rows += row
-                    count += 1
-            except Exception as e:
-                print ('Error on row number: ' + str(count))
-                print ('Error msg: ' + str(e))
-        else:
-            try:
-                for row in freader:
-                    rows.append(row)
-                    count += 1
-            except Exception as e:
-                print ('Error on row number: ' + str(count))
-                print ('Error msg: ' + str(e))
-    return rows
+        chunk = []
+        try:
+            for row in freader:
+                if mode=='text':
+                    items = [field[1 : -1] if quoted_field_p(field) else field for field in row]
+                else:
+                    items = [row]
+                count += 1
+                if chunksize is None:
+                    yield from items
+                else:
+                    chunk += items
+                    while len(chunk) >= chunksize:
+                        yield chunk[:chunksize]
+                        chunk = chunk[chunksize:]
+        except Exception as e:
+            print ('Error on row number: ' + str(count))
+            print ('Error msg: ' + str(e))
+        if chunk:
+            yield chunk
+
+#-------------------------------------------------------------------------------------------
+
+def load_csv_file (file, mode='rows', encoding='utf-8', quotechar='|'):
+    return list(iter_csv_file(file, mode, encoding, quotechar=quotechar))
 
 #--------------------------------------------------------------------------------------
 
-def load_csv_dataframe  (file, mode='rows', encoding='utf-8'):
-    rows = load_csv_file(file, mode='rows', encoding='utf-8')
+def load_csv_dataframe  (file, mode='rows', encoding='utf-8', quotechar='|'):
+    import pandas as pd
+    rows = load_csv_file(file, mode='rows', encoding=encoding, quotechar=quotechar)
     return pd.DataFrame(rows[1:], columns = rows[0])
 
 #--------------------------------------------------------------------------------------
 
+# Yields DataFrames of up to <chunksize> rows using pandas' C parser, so memory
+# stays bounded whatever the file size. <dtype> is passed to read_csv; the
+# default reads every column as a string rather than inferring types.
+# Quotes use '|', as written by save_csv_file.
+
+def iter_csv_dataframes (file, chunksize=100000, dtype=str, encoding='utf-8',
+                         quotechar='|', **kwargs):
+    import pandas as pd
+    with pd.read_csv(file, chunksize=chunksize, dtype=dtype, encoding=encoding,
+                     quotechar=quotechar, engine='c', **kwargs) as reader:
+        for df in reader:
+            yield df
+
+#--------------------------------------------------------------------------------------
+
 # Python 3.6 supposedly handles unicode natively. We'll see. 
 
 # Lines can be a list of strings and will be converted to single column format.
 
-def save_csv_file (lines, file, encoding='utf-8'):
+def save_csv_file (lines, file, encoding='utf-8', quotechar='|', delimiter=','):
     with open(file, 'w', newline='\n', encoding=encoding) as csvfile:
-        fwriter = csv.writer(csvfile, delimiter=',', quotechar='|',
+        fwriter = csv.writer(csvfile, delimiter=delimiter, quotechar=quotechar,
                              quoting=csv.QUOTE_MINIMAL)
         for line in lines:
             # Allow strings as single column
@@ -154,24 +270,28 @@ def save_csv_file (lines, file, encoding='utf-8'):
 
 lexicon_classified_file = 'c:\\Projects\\Python\\sentiment\\data\\lexicon_classified.xlsx'
 
-# Returns a Pandas Data Frame
+# Returns a Pandas Data Frame of the first sheet, read with the fastest
+# installed engine (see excel_reader_engine).
 
-def load_excel_file(file):
-    xls_file = pd.ExcelFile(file)
-    df = xls_file.parse(0)
-    return df
+def load_excel_file(file, sheet_name=0):
+    import pandas as pd
+    return pd.read_excel(file, sheet_name=sheet_name, engine=excel_reader_engine(file))
  
 #--------------------------------------------------------------------------------------
 
+# ExcelWriter is closed (and the file written) by the with statement;
+# writer.save() no longer exists in pandas.
+
 def save_excel_file(df, file, sheet_name='PySheet'):
-    writer = pd.ExcelWriter(file, engine='xlsxwriter')
-    df.to_excel(writer, sheet_name=sheet_name, index=False)
-    writer.save()
+    import pandas as pd
+    with pd.ExcelWriter(file, engine=excel_writer_engine()) as writer:
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
     return True
 
 #--------------------------------------------------------------------------------------
 
 def save_list_to_excel(l, file, sheet_name='PySheet', sort=False):
+    import pandas as pd
     if sort==True:
         l.sort()
     df = pd.DataFrame(l)
@@ -187,11 +307,6 @@ def save_list_to_excel(l, file, sheet_name='PySheet', sort=False):
 # Install pdfminer using: pip install git+https://github.com/pdfminer/pdfminer.six.git
 # NB: Needed to change StringIO import statement to import from io in Python 3
 
-from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.pdfpage import PDFPage
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
-
 from io import StringIO
 
 # Upgraded to handle exceptions of type NameError when text extraction not allowed:
@@ -202,7 +317,13 @@ from io import StringIO
 # <ipython-input-49-3103147440c4> in <module>()
 # ----> 1 PDFTextExtractionNotAllowed
 
-def load_pdf_file(pdfname):
+# <maxpages> limits extraction to the first pages of the file; 0 means all.
+
+def load_pdf_file(pdfname, maxpages=0):
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
 
     try:
         # PDFMiner boilerplate
@@ -215,7 +336,7 @@ def load_pdf_file(pdfname):
         
         # Extract text
         fp = open(pdfname, 'rb')
-        for page in PDFPage.get_pages(fp):
+        for page in PDFPage.get_pages(fp, maxpages=maxpages):
             interpreter.process_page(page)
         fp.close()
             
@@ -234,7 +355,106 @@ def load_pdf_file(pdfname):
 
 def load_pdf_directory(dir):
     files = files_in_dir(dir)
-    return [_pdf_file(f) for f in files]
+    return [load_pdf_file(f) for f in files]
+
+#-------------------------------------------------------------------------------------------
+# Parallel PDF Extraction
+#-------------------------------------------------------------------------------------------
+
+# Derived from BaseException so that it is not swallowed by the generic
+# exception handler of load_pdf_file.
+
+class PDFTimeoutError(BaseException):
+    pass
+
+def raise_pdf_timeout (signum, frame):
+    raise PDFTimeoutError()
+
+#-------------------------------------------------------------------------------------------
+
+# Runs load_pdf_file with a limit of <timeout> seconds. Returns None when
+# the limit is reached. The limit relies on SIGALRM and is ignored on
+# platforms without it.
+
+def load_pdf_file_timed (pdfname, timeout=None, maxpages=0):
+    if timeout is None or not hasattr(signal, 'SIGALRM'):
+        return load_pdf_file(pdfname, maxpages)
+    previous = signal.signal(signal.SIGALRM, raise_pdf_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return load_pdf_file(pdfname, maxpages)
+    except PDFTimeoutError:
+        return None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+#-------------------------------------------------------------------------------------------
+
+def file_hash (pathname, block_size=1048576):
+    digest = hashlib.sha256()
+    with open(pathname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+#-------------------------------------------------------------------------------------------
+
+# Extracted text is cached under <cache_dir> by content hash and page limit,
+# sharded on the first two hex digits of the hash.
+
+def pdf_cache_pathname (cache_dir, digest, maxpages=0):
+    return join(cache_dir, digest[:2], digest + '-' + str(maxpages) + '.txt')
+
+def load_cached_pdf_text (cache_dir, digest, maxpages=0):
+    pathname = pdf_cache_pathname(cache_dir, digest, maxpages)
+    if isfile(pathname):
+        return load_text_file(pathname)
+    return None
+
+def save_cached_pdf_text (text, cache_dir, digest, maxpages=0):
+    pathname = pdf_cache_pathname(cache_dir, digest, maxpages)
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    return save_text_file([text], pathname)
+
+#-------------------------------------------------------------------------------------------
+
+# Yields (path, sentences) for the PDF files of <dir> as they complete.
+# Extraction runs in a pool of <workers> processes (defaults to the number of
+# CPUs), each file limited to <timeout> seconds and <maxpages> pages. Files
+# that time out yield no sentences. With a <cache_dir>, files whose content
+# hash is already cached are not parsed again.
+
+def iter_pdf_directory (dir, delimiter='.', remove=['\n'], workers=None, timeout=None,
+                        maxpages=0, cache_dir=None):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    files = [f for f in files_in_dir(dir) if f.lower().endswith('.pdf')]
+    todo = []
+    for f in files:
+        digest = file_hash(f) if cache_dir is not None else None
+        text = load_cached_pdf_text(cache_dir, digest, maxpages) if digest else None
+        if text is not None:
+            yield f, parse_text(text, delimiter, remove)
+        else:
+            todo.append((f, digest))
+    if not todo:
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(load_pdf_file_timed, f, timeout, maxpages): (f, digest)
+                   for f, digest in todo}
+        for future in as_completed(futures):
+            f, digest = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                print ('Error extracting ' + f + ': ' + str(e))
+                text = None
+            if text is None:
+                yield f, []
+            else:
+                if digest is not None:
+                    save_cached_pdf_text(text, cache_dir, digest, maxpages)
+                yield f, parse_text(text, delimiter, remove)
 
 #-------------------------------------------------------------------------------------------
 # Dowloading Files
@@ -253,20 +473,88 @@ def download_file(download_url):
 # Parsers
 #-------------------------------------------------------------------------------------------
 
+# Character class removing every character of <remove>. The characters are
+# escaped individually, so ']', '^', '\\' or '|' are treated literally and
+# only what was asked for is removed. Patterns are compiled once.
+
+@lru_cache(maxsize=64)
+def removal_pattern (remove):
+    chars = ''.join(remove)
+    if not chars:
+        return None
+    return re.compile('[' + ''.join([re.escape(c) for c in sorted(set(chars))]) + ']')
+
+#-------------------------------------------------------------------------------------------
+
+# Incremental sentence splitter. feed() takes successive chunks of a text
+# (str, or bytes decoded incrementally with <encoding>) and returns the
+# sentences completed so far; the text after the last delimiter is held
+# until the next chunk, so sentences spanning chunk boundaries come out
+# whole. close() returns the remainder. Splitting a text in any number of
+# chunks gives the same sentences as parse_text on the whole text.
+
+class SentenceSplitter:
+
+    def __init__(self, delimiter='.', remove=['\n'], encoding='utf-8'):
+        self.delimiter = delimiter
+        self.removal = removal_pattern(tuple(remove))
+        self.encoding = encoding
+        self.decoder = None
+        self.pending = ''
+
+    def decode(self, chunk, final=False):
+        if self.decoder is None:
+            import codecs
+            self.decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        return self.decoder.decode(chunk, final)
+
+    def feed(self, chunk):
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = self.decode(chunk)
+        if self.removal is not None:
+            chunk = self.removal.sub('', chunk)
+        sentences = (self.pending + chunk).split(self.delimiter)
+        self.pending = sentences.pop()
+        return sentences
+
+    def close(self):
+        sentences = []
+        if self.decoder is not None:
+            sentences = self.feed(self.decode(b'', final=True))
+        sentences.append(self.pending)
+        self.pending = ''
+        return sentences
+
+#-------------------------------------------------------------------------------------------
+
+# Yields the sentences of a stream of text chunks: iter_text_file(file,
+# 'chunks'), pages of a PDF, or an HTTP body (response.iter_content()).
+
+def iter_sentences (chunks, delimiter='.', remove=['\n'], encoding='utf-8'):
+    splitter = SentenceSplitter(delimiter, remove, encoding)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+#-------------------------------------------------------------------------------------------
+
+def iter_file_sentences (pathname, delimiter='.', remove=['\n'], encoding='utf-8',
+                         buffer_size=text_buffer_size):
+    chunks = iter_text_file(pathname, 'chunks', encoding, buffer_size)
+    return iter_sentences(chunks, delimiter, remove)
+
+#-------------------------------------------------------------------------------------------
+
 def parse_text (text, delimiter='.', remove=['\n']):
-    # Build a dijunctive pattern of chars to match 
-    reg = '[' + '|'.join(remove) + ']'
-    # Removing matching chars
-    text = re.sub(reg, '', text)
-    # Split text into sentences
-    sentences = text.split(delimiter)
-    return(sentences)
+    splitter = SentenceSplitter(delimiter, remove)
+    sentences = splitter.feed(text)
+    sentences.extend(splitter.close())
+    return sentences
     
 #-------------------------------------------------------------------------------------------
 
-def parse_text_file (pathname, delimiter='.', remove=[]):
-    text = load_csv_file(pathname, mode='text')
-    return parse_text (text, delimiter, remove)
+def parse_text_file (pathname, delimiter='.', remove=[], encoding='utf-8'):
+    return list(iter_file_sentences(pathname, delimiter, remove, encoding))
     
 #-------------------------------------------------------------------------------------------
 
@@ -276,38 +564,439 @@ def parse_pdf_file (pathname, delimiter='.', remove=['\n']):
   
 #-------------------------------------------------------------------------------------------
 
-def parse_pdf_directory (dir, delimiter='.', remove=['\n']):
-    files = files_in_dir(dir)
+# Sentences of all PDF files in <dir>, in directory order. See
+# iter_pdf_directory for the other options.
+
+def parse_pdf_directory (dir, delimiter='.', remove=['\n'], workers=None, timeout=None,
+                         maxpages=0, cache_dir=None):
+    results = dict(iter_pdf_directory(dir, delimiter, remove, workers, timeout,
+                                      maxpages, cache_dir))
     sentences = []
-    for file in files:
-        sentences = sentences + parse_pdf_file(file)
+    for file in files_in_dir(dir):
+        sentences.extend(results.get(file, []))
     return sentences
 
 #-------------------------------------------------------------------------------------------
 # Directory Processing Functions
 #-------------------------------------------------------------------------------------------
 
-def map_files_in_dir (root_dir, fn, recursive=True):
-    files = files_in_dir(root_dir)
-    for f in files:
-        fn(f)
-    if recursive==True:
-        dirs = dirs_in_dir(root_dir)
-        for d in dirs:
-            map_files_in_dir(d, fn, recursive=True)
+# True if the file name <name> matches the glob <pattern> and has one of
+# <extensions> (e.g. ['.txt', '.pdf'], case-insensitive). None matches all.
+
+def file_name_match_p (name, pattern=None, extensions=None):
+    if pattern is not None and not fnmatch.fnmatch(name, pattern):
+        return False
+    if extensions is not None:
+        return name.lower().endswith(tuple([e.lower() for e in extensions]))
+    return True
 
 #-------------------------------------------------------------------------------------------
 
-def reduce_files_in_dir (root_dir, fn, acc, recursive=True):
-    files = files_in_dir(root_dir)
+# Yields the files under <root_dir>: the files of a directory first, then
+# those of each of its subdirectories, in the same order as the recursive
+# map_files_in_dir used to. The walk uses an explicit stack, so deep trees
+# don't hit the recursion limit, and scandir's cached entry types.
+
+def walk_files (root_dir, recursive=True, pattern=None, extensions=None,
+                follow_symlinks=False):
+    if extensions is not None:
+        extensions = tuple([e.lower() for e in extensions])
+    stack = [root_dir]
+    while stack:
+        dir = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(dir) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=follow_symlinks):
+                        if file_name_match_p(entry.name, pattern, extensions):
+                            yield entry.path
+                    elif recursive and entry.is_dir(follow_symlinks=follow_symlinks):
+                        subdirs.append(entry.path)
+        except OSError as e:
+            print ('Error reading ' + dir + ': ' + str(e))
+        stack.extend(reversed(subdirs))
+
+#-------------------------------------------------------------------------------------------
+
+def make_executor (workers, executor='thread'):
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    if executor == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers)
+
+#-------------------------------------------------------------------------------------------
+
+# Yields (item, fn(item)) for <items> using a pool of <workers> threads or
+# processes. With <ordered> results come in input order, otherwise as they
+# complete. At most <window> items (default 4 per worker) are in flight, so
+# <items> can be a lazy stream of millions of files.
+
+def pool_map (fn, items, workers=None, executor='thread', ordered=True, window=None):
+    from concurrent.futures import wait, FIRST_COMPLETED
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    items = iter(items)
+    with make_executor(workers, executor) as pool:
+        if ordered:
+            pending = deque()
+            for item in items:
+                pending.append((item, pool.submit(fn, item)))
+                if len(pending) >= window:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        else:
+            pending = {}
+            for item in items:
+                pending[pool.submit(fn, item)] = item
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+#-------------------------------------------------------------------------------------------
+
+# Yields (file, fn(file)) for the files under <root_dir>. See walk_files for
+# the filters and pool_map for the parallel options; <workers>=None runs
+# serially.
+
+def iter_map_files_in_dir (root_dir, fn, recursive=True, pattern=None, extensions=None,
+                           workers=None, executor='thread', ordered=True):
+    files = walk_files(root_dir, recursive, pattern, extensions)
+    if workers is None:
+        for f in files:
+            yield f, fn(f)
+    else:
+        yield from pool_map(fn, files, workers, executor, ordered)
+
+#-------------------------------------------------------------------------------------------
+
+def map_files_in_dir (root_dir, fn, recursive=True, pattern=None, extensions=None,
+                      workers=None, executor='thread', ordered=True):
+    for f, result in iter_map_files_in_dir(root_dir, fn, recursive, pattern, extensions,
+                                           workers, executor, ordered):
+        pass
+
+#-------------------------------------------------------------------------------------------
+
+# Folds a chunk of files starting from a fresh copy of <identity>, so that
+# chunks never share a mutable accumulator.
+
+def reduce_file_chunk (fn, identity, files):
+    import copy
+    acc = copy.deepcopy(identity)
     for f in files:
         acc = fn(acc, f)
-    if recursive==True:
-        dirs = dirs_in_dir(root_dir)
-        for d in dirs:
-            acc = reduce_files_in_dir(d, fn, acc, recursive=True)
     return acc
 
+def chunk_iterator (items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Combines <values> pairwise, round by round, using <pool> when given. The
+# order of the values is kept, so <combine> need only be associative.
+
+def tree_combine (combine, values, pool=None):
+    while len(values) > 1:
+        pairs = [(values[i], values[i + 1]) for i in range(0, len(values) - 1, 2)]
+        if pool is None:
+            combined = [combine(a, b) for a, b in pairs]
+        else:
+            combined = list(pool.map(combine, [a for a, b in pairs], [b for a, b in pairs]))
+        if len(values) % 2 == 1:
+            combined.append(values[-1])
+        values = combined
+    return values[0]
+
+#-------------------------------------------------------------------------------------------
+
+# Folds fn(acc, file) over the files under <root_dir>. With <workers>, files
+# are split into chunks of <chunksize>, each chunk is folded in the pool
+# starting from a copy of <identity>, and the partial results are merged by
+# tree_combine with the associative <combine>, which is required since <fn>
+# takes a file, not a second accumulator. If <identity> is None, <acc>
+# itself must be the identity of <combine> (0, [], ...); otherwise the
+# result is combine(acc, merged partials).
+
+def reduce_files_in_dir (root_dir, fn, acc, recursive=True, pattern=None, extensions=None,
+                         workers=None, executor='thread', combine=None, identity=None,
+                         chunksize=1000):
+    if workers is not None and combine is None:
+        raise ValueError('reduce_files_in_dir needs a combine function when workers is given')
+    files = walk_files(root_dir, recursive, pattern, extensions)
+    if workers is None:
+        for f in files:
+            acc = fn(acc, f)
+        return acc
+    from functools import partial
+    start = acc if identity is None else identity
+    chunks = chunk_iterator(files, chunksize)
+    reducer = partial(reduce_file_chunk, fn, start)
+    partials = [result for chunk, result in pool_map(reducer, chunks, workers, executor)]
+    if not partials:
+        return acc
+    with make_executor(workers, executor) as pool:
+        result = tree_combine(combine, partials, pool)
+    return result if identity is None else combine(acc, result)
+
+#-------------------------------------------------------------------------------------------
+# Format Registry
+#-------------------------------------------------------------------------------------------
+
+# files.load(path) and files.save(obj, path) dispatch on the file extension
+# to the loader and saver registered for it. Engines are chosen among the
+# installed ones when a file is read or written, so nothing heavy is
+# imported until then.
+
+@lru_cache(maxsize=None)
+def module_available_p (name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+#-------------------------------------------------------------------------------------------
+
+# calamine (Rust) is much faster than openpyxl, which pandas already opens
+# read-only. Old .xls files need xlrd.
+
+def excel_reader_engine (file=''):
+    if module_available_p('python_calamine'):
+        return 'calamine'
+    if str(file).lower().endswith('.xls') and module_available_p('xlrd'):
+        return 'xlrd'
+    return 'openpyxl'
+
+def excel_writer_engine ():
+    return 'xlsxwriter' if module_available_p('xlsxwriter') else 'openpyxl'
+
+def csv_reader_engine ():
+    return 'pyarrow' if module_available_p('pyarrow') else 'c'
+
+#-------------------------------------------------------------------------------------------
+
+file_formats = {}
+
+def register_file_format (extensions, load=None, save=None):
+    for ext in extensions:
+        file_formats[ext.lower()] = {'load': load, 'save': save}
+
+# Registered extension of <path>, longest first so that '.csv.gz' wins
+# over '.gz'.
+
+def file_format (path, format=None):
+    if format is not None:
+        return format if format.startswith('.') else '.' + format
+    name = str(path).lower()
+    for ext in sorted(file_formats, key=len, reverse=True):
+        if name.endswith(ext):
+            return ext
+    raise ValueError('No file format registered for: ' + str(path))
+
+#-------------------------------------------------------------------------------------------
+
+def load (path, format=None, **kwargs):
+    loader = file_formats[file_format(path, format)]['load']
+    if loader is None:
+        raise ValueError('Format can not be loaded: ' + str(path))
+    return loader(path, **kwargs)
+
+def save (obj, path, format=None, **kwargs):
+    saver = file_formats[file_format(path, format)]['save']
+    if saver is None:
+        raise ValueError('Format can not be saved: ' + str(path))
+    return saver(obj, path, **kwargs)
+
+#-------------------------------------------------------------------------------------------
+# Format Loaders & Savers
+#-------------------------------------------------------------------------------------------
+
+# CSV files are read into DataFrames with pyarrow's multithreaded parser
+# when installed. Options it does not support fall back to the C parser.
+# Unlike the legacy helpers above, the registry uses standard '"' quoting.
+
+def load_csv_format (path, engine=None, sep=',', **kwargs):
+    import pandas as pd
+    engine = engine or csv_reader_engine()
+    if engine == 'pyarrow' and 'chunksize' not in kwargs:
+        try:
+            return pd.read_csv(path, sep=sep, engine='pyarrow', **kwargs)
+        except ValueError:
+            pass
+    return pd.read_csv(path, sep=sep, engine='c', **kwargs)
+
+def save_csv_format (obj, path, sep=',', **kwargs):
+    if hasattr(obj, 'to_csv'):
+        obj.to_csv(path, sep=sep, index=False, **kwargs)
+        return True
+    return save_csv_file(obj, path, quotechar='"', delimiter=sep, **kwargs)
+
+def load_tsv_format (path, **kwargs):
+    return load_csv_format(path, sep='\t', **kwargs)
+
+def save_tsv_format (obj, path, **kwargs):
+    return save_csv_format(obj, path, sep='\t', **kwargs)
+
+#-------------------------------------------------------------------------------------------
+
+def load_parquet_format (path, **kwargs):
+    import pandas as pd
+    return pd.read_parquet(path, **kwargs)
+
+def save_parquet_format (df, path, **kwargs):
+    df.to_parquet(path, index=False, **kwargs)
+    return True
+
+def load_feather_format (path, **kwargs):
+    import pandas as pd
+    return pd.read_feather(path, **kwargs)
+
+def save_feather_format (df, path, **kwargs):
+    df.reset_index(drop=True).to_feather(path, **kwargs)
+    return True
+
+#-------------------------------------------------------------------------------------------
+
+def load_excel_format (path, sheet_name=0, engine=None, **kwargs):
+    import pandas as pd
+    engine = engine or excel_reader_engine(path)
+    return pd.read_excel(path, sheet_name=sheet_name, engine=engine, **kwargs)
+
+def save_excel_format (obj, path, sheet_name='PySheet'):
+    if hasattr(obj, 'to_excel'):
+        return save_excel_file(obj, path, sheet_name)
+    return save_list_to_excel(obj, path, sheet_name)
+
+#-------------------------------------------------------------------------------------------
+
+def save_text_format (obj, path, encoding='utf-8'):
+    if isinstance(obj, str):
+        obj = [obj]
+    return save_text_file(obj, path, encoding)
+
+def load_json_format (path, encoding='utf-8'):
+    import json
+    with open(path, encoding=encoding) as f:
+        return json.load(f)
+
+def save_json_format (obj, path, encoding='utf-8'):
+    import json
+    with open(path, 'w', encoding=encoding) as f:
+        json.dump(obj, f, ensure_ascii=False)
+    return True
+
+def load_jsonl_format (path, **kwargs):
+    import pandas as pd
+    return pd.read_json(path, lines=True, **kwargs)
+
+def save_jsonl_format (df, path, **kwargs):
+    df.to_json(path, orient='records', lines=True, force_ascii=False, **kwargs)
+    return True
+
+#-------------------------------------------------------------------------------------------
+
+register_file_format(['.csv', '.csv.gz', '.csv.bz2', '.csv.zip'], load_csv_format, save_csv_format)
+register_file_format(['.tsv'], load_tsv_format, save_tsv_format)
+register_file_format(['.parquet'], load_parquet_format, save_parquet_format)
+register_file_format(['.feather', '.arrow'], load_feather_format, save_feather_format)
+register_file_format(['.xlsx', '.xlsm', '.xls'], load_excel_format, save_excel_format)
+register_file_format(['.txt'], load_text_file, save_text_format)
+register_file_format(['.json'], load_json_format, save_json_format)
+register_file_format(['.jsonl'], load_jsonl_format, save_jsonl_format)
+register_file_format(['.pdf'], load_pdf_file, None)
+
+#*******************************************************************************************
+# Part 2: Benchmarks
+#*******************************************************************************************
+
+#-------------------------------------------------------------------------------------------
+# Sentence Splitting
+#-------------------------------------------------------------------------------------------
+
+# The regex-per-call splitter parse_text used to be, kept for comparison.
+
+def parse_text_regex (text, delimiter='.', remove=['\n']):
+    reg = '[' + '|'.join(remove) + ']'
+    text = re.sub(reg, '', text)
+    return text.split(delimiter)
+
+# Throughput in MB/s of parse_text_regex, parse_text, and iter_sentences
+# over <chunk_size> chunks, on the text file <pathname> (or generated text).
+
+def benchmark_parse_text (pathname=None, repeat=5, chunk_size=65536):
+    import time
+    from tabulate import tabulate
+    if pathname is None:
+        text = 'Lorem ipsum dolor sit amet, consectetur\nadipiscing elit. ' * 200000
+    else:
+        text = load_text_file(pathname)
+    megabytes = len(text.encode('utf-8')) / 1e6
+    chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+    candidates = [['parse_text (regex per call)', lambda: parse_text_regex(text)],
+                  ['parse_text', lambda: parse_text(text)],
+                  ['iter_sentences (chunked)', lambda: list(iter_sentences(chunks))]]
+    table = []
+    for name, fn in candidates:
+        start = time.perf_counter()
+        for i in range(repeat):
+            count = len(fn())
+        seconds = (time.perf_counter() - start) / repeat
+        table.append([name, count, round(seconds, 4), round(megabytes / seconds, 1)])
+    print (tabulate(table, headers=['Splitter', 'Sentences', 'Seconds', 'MB/s']))
+    return table
+
+#-------------------------------------------------------------------------------------------
+# File Formats
+#-------------------------------------------------------------------------------------------
+
+# Save and load times and file sizes of <df> (or a generated frame of
+# <rows> rows like the scraper's sentence output) for each format and
+# installed engine, written to <dir>.
+
+def benchmark_file_formats (df=None, rows=100000, dir=None, repeat=3):
+    import time
+    import tempfile
+    import pandas as pd
+    from tabulate import tabulate
+    if df is None:
+        df = pd.DataFrame({'website': [i % 500 for i in range(rows)],
+                           'source': ['https://example.com/page/%d' % (i % 5000) for i in range(rows)],
+                           'sentence': ['Sentence number %d, with "quotes" and | pipes' % i
+                                        for i in range(rows)]})
+    dir = dir or tempfile.mkdtemp()
+    candidates = [['csv', 'c', '.csv', {'engine': 'c'}],
+                  ['csv', 'pyarrow', '.csv', {'engine': 'pyarrow'}],
+                  ['parquet', 'pyarrow', '.parquet', {}],
+                  ['feather', 'pyarrow', '.feather', {}],
+                  ['excel', 'openpyxl', '.xlsx', {'engine': 'openpyxl'}],
+                  ['excel', 'calamine', '.xlsx', {'engine': 'calamine'}]]
+    table = []
+    for name, engine, ext, options in candidates:
+        if engine in ('pyarrow', 'calamine') and not module_available_p(
+                'pyarrow' if engine == 'pyarrow' else 'python_calamine'):
+            continue
+        path = os.path.join(dir, 'benchmark' + ext)
+        start = time.perf_counter()
+        save(df, path)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(repeat):
+            loaded = load(path, **options)
+        load_seconds = (time.perf_counter() - start) / repeat
+        table.append([name, engine, round(save_seconds, 3), round(load_seconds, 3),
+                      round(os.path.getsize(path) / 1e6, 2), len(loaded) == len(df)])
+    print (tabulate(table, headers=['Format', 'Engine', 'Save (s)', 'Load (s)', 'MB', 'OK']))
+    return table
+
 #-------------------------------------------------------------------------------------------
 # End of File
 #-------------------------------------------------------------------------------------------
@@ -0,0 +1,255 @@
+#---------------------------------------------------------------------------
+# Last Names: Fast Loader & Compact Sorted Name Array
+#---------------------------------------------------------------------------
+
+# indata/english/last_names.csv has old Mac CR line endings, which generic
+# CSV sniffing handles badly (some readers return one giant field). This
+# loader detects the line terminator and encoding from the first block and
+# streams the names. NameArray keeps the deduplicated names sorted in one
+# utf-8 buffer plus an offsets array, instead of one Python str per name,
+# and answers exact and prefix lookups by binary search.
+
+import os
+import time
+import codecs
+
+import numpy as np
+
+#---------------------------------------------------------------------------
+# Files
+#---------------------------------------------------------------------------
+
+english_last_names = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'indata', 'english', 'last_names.csv')
+
+block_size = 1 << 16
+
+#---------------------------------------------------------------------------
+# Detection
+#---------------------------------------------------------------------------
+
+# b'\r\n', b'\r' or b'\n', whichever terminates most lines of <sample>.
+
+def detect_line_terminator (sample):
+    crlf = sample.count(b'\r\n')
+    cr = sample.count(b'\r') - crlf
+    lf = sample.count(b'\n') - crlf
+    if crlf >= cr and crlf >= lf and crlf > 0:
+        return b'\r\n'
+    return b'\r' if cr > lf else b'\n'
+
+#---------------------------------------------------------------------------
+
+# Encoding of <sample> from its BOM, else utf-8 if it decodes, else cp1252
+# (which, like Latin-1, accepts any byte).
+
+def detect_encoding (sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith(codecs.BOM_UTF16_LE) or sample.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    try:
+        # A multi-byte character may be cut at the end of the sample.
+        sample[:-4].decode('utf-8') if len(sample) > 4 else sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+#---------------------------------------------------------------------------
+# Loader
+#---------------------------------------------------------------------------
+
+# Yields, block by block, lists of the utf-8 encoded names of <file> (one
+# per line), reading <block_size> blocks. The terminator and encoding are
+# detected from the first block unless given; other encodings are
+# transcoded a block at a time. With <header> the first line ('lastname')
+# is skipped.
+
+def iter_last_name_blocks (file=english_last_names, header=True, terminator=None,
+                           encoding=None):
+    with open(file, 'rb') as f:
+        block = f.read(block_size)
+        terminator = terminator or detect_line_terminator(block)
+        encoding = encoding or detect_encoding(block)
+        if encoding == 'utf-16':
+            # Fixed-width code units: transcode everything, then split.
+            block = (block + f.read()).decode(encoding).encode('utf-8')
+            terminator = terminator.replace(b'\x00', b'')
+            encoding = 'utf-8'
+        elif encoding == 'utf-8-sig':
+            block = block[len(codecs.BOM_UTF8):]
+            encoding = 'utf-8'
+        decoder = codecs.getincrementaldecoder(encoding)() if encoding != 'utf-8' else None
+        pending = b''
+        skip = header
+        while block:
+            if decoder is not None:
+                block = decoder.decode(block).encode('utf-8')
+            lines = (pending + block).split(terminator)
+            pending = lines.pop()
+            if skip and lines:
+                lines = lines[1:]
+                skip = False
+            yield [line for line in map(bytes.strip, lines) if line]
+            block = f.read(block_size)
+        pending = pending.strip()
+        if pending and not skip:
+            yield [pending]
+
+#---------------------------------------------------------------------------
+
+def iter_last_names (file=english_last_names, header=True, terminator=None, encoding=None):
+    for names in iter_last_name_blocks(file, header, terminator, encoding):
+        for name in names:
+            yield name.decode('utf-8')
+
+#---------------------------------------------------------------------------
+
+def load_last_names (file=english_last_names, header=True, casefold=False):
+    if casefold:
+        return NameArray.from_names(name.casefold() for name in iter_last_names(file, header))
+    keys = []
+    for names in iter_last_name_blocks(file, header):
+        keys.extend(names)
+    return NameArray.from_keys(keys)
+
+#---------------------------------------------------------------------------
+# Name Array
+#---------------------------------------------------------------------------
+
+# Sorted, deduplicated names stored as one utf-8 buffer and n + 1 offsets.
+# Names sort by their utf-8 bytes, i.e. by code point.
+
+class NameArray:
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_names(cls, names):
+        return cls.from_keys([name.encode('utf-8') for name in names])
+
+    # <keys> are utf-8 encoded names. Sorting before deduplicating keeps
+    # this linear on already sorted input, such as last_names.csv.
+
+    @classmethod
+    def from_keys(cls, keys):
+        keys = sorted(keys)
+        keys = list(dict.fromkeys(keys))
+        offsets = np.zeros(len(keys) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum(np.fromiter(map(len, keys), dtype=np.uint32, count=len(keys)))
+        return cls(b''.join(keys), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def key(self, i):
+        return self.buffer[self.offsets[i] : self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('NameArray index out of range')
+        return self.key(i).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.key(i).decode('utf-8')
+
+    # First position whose name is >= <key> (utf-8 bytes).
+
+    def lower_bound(self, key):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Position of <name>, or -1.
+
+    def index(self, name):
+        key = name.encode('utf-8')
+        i = self.lower_bound(key)
+        return i if i < len(self) and self.key(i) == key else -1
+
+    def __contains__(self, name):
+        return self.index(name) >= 0
+
+    # Range of positions of the names starting with <prefix>.
+
+    def prefix_range(self, prefix):
+        key = prefix.encode('utf-8')
+        start = self.lower_bound(key)
+        stop = start
+        lo, hi = start, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid).startswith(key):
+                lo = mid + 1
+            else:
+                hi = mid
+        stop = lo
+        return range(start, stop)
+
+    def prefix(self, prefix, limit=None):
+        positions = self.prefix_range(prefix)
+        if limit is not None:
+            positions = positions[:limit]
+        return [self[i] for i in positions]
+
+    def nbytes(self):
+        return len(self.buffer) + self.offsets.nbytes
+
+#---------------------------------------------------------------------------
+# Benchmark
+#---------------------------------------------------------------------------
+
+# Compares the pandas path (read_csv, dedup, sort, isin) with
+# load_last_names and NameArray lookups on <file>.
+
+def benchmark_last_names (file=english_last_names, lookups=100000, repeat=3):
+    import sys
+    import random
+    import pandas as pd
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        df = pd.read_csv(file)
+        series = df['lastname'].drop_duplicates().sort_values()
+    pandas_load = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        names = load_last_names(file)
+    array_load = (time.perf_counter() - start) / repeat
+
+    queries = random.Random(1).choices(list(series), k=lookups)
+    start = time.perf_counter()
+    name_set = set(series)
+    set_found = sum([1 for q in queries if q in name_set])
+    set_time = time.perf_counter() - start
+    start = time.perf_counter()
+    array_found = sum([1 for q in queries if q in names])
+    array_time = time.perf_counter() - start
+
+    result = {'names': len(names), 'same_names': list(series) == list(names),
+              'same_lookups': set_found == array_found,
+              'pandas_load_ms': round(pandas_load * 1000, 2),
+              'array_load_ms': round(array_load * 1000, 2),
+              'pandas_bytes': int(series.memory_usage(deep=True)),
+              'set_bytes': sys.getsizeof(name_set) + sum([sys.getsizeof(n) for n in name_set]),
+              'array_bytes': names.nbytes(),
+              'set_lookups_per_second': int(lookups / set_time),
+              'array_lookups_per_second': int(lookups / array_time)}
+    for k, v in result.items():
+        print (k + ': ' + str(v))
+    return result
+
+#---------------------------------------------------------------------------
+# End of File
+#---------------------------------------------------------------------------
@@ -0,0 +1,305 @@
+#---------------------------------------------------------------------------
+# Runtime Gender Lookup for First & Last Names
+#---------------------------------------------------------------------------
+
+# Compiled index built from the outputs of prepdata.py (FirstNamesGirls.csv,
+# FirstNamesBoys.csv and LastNames.csv). Names are case- and accent-
+# normalized and keyed by a 64-bit hash kept in a sorted array, with the
+# probability that the name is female and first/last name flags alongside.
+# The index is saved as a single binary file that is memory-mapped on load:
+# loading takes milliseconds, and worker processes opening the same file
+# share its pages read-only.
+
+import os
+import re
+import time
+import hashlib
+import unicodedata
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+#---------------------------------------------------------------------------
+# Files
+#---------------------------------------------------------------------------
+
+# Same locations as prepdata.py, resolved when needed so that importing
+# this module does not require GOZUP to be set.
+
+def names_dir ():
+    return join (os.environ['GOZUP'], '..', 'libs', 'newgender')
+
+def default_index_file ():
+    return join(names_dir(), 'GenderIndex.bin')
+
+#---------------------------------------------------------------------------
+# Name Normalization
+#---------------------------------------------------------------------------
+
+combining_pattern = re.compile('[\u0300-\u036f]')
+space_pattern = re.compile(r'\s+')
+
+# 'Zoé ' -> 'zoe', 'JEAN  Luc' -> 'jean luc'
+
+def normalize_name (name):
+    name = unicodedata.normalize('NFKD', str(name))
+    name = combining_pattern.sub('', name).casefold()
+    return space_pattern.sub(' ', name).strip()
+
+#---------------------------------------------------------------------------
+
+# Vectorized normalize_name over a Series of names.
+
+def normalize_names (names):
+    names = pd.Series(names, dtype=object).fillna('').astype(str)
+    names = names.str.normalize('NFKD').str.replace(combining_pattern, '', regex=True)
+    return names.str.casefold().str.replace(space_pattern, ' ', regex=True).str.strip()
+
+#---------------------------------------------------------------------------
+
+def name_hash (normalized):
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+#---------------------------------------------------------------------------
+# Gender Tables
+#---------------------------------------------------------------------------
+
+FIRST_NAME = 1
+LAST_NAME = 2
+
+# Builds the table the index is compiled from: one row per normalized name
+# with female and male weights (counts, or 1 for membership in a list) and
+# a last-name flag. Names appearing under several spellings are merged.
+
+def make_gender_table (girls=[], boys=[], last_names=[]):
+    frames = [pd.DataFrame({'name': list(girls), 'female': 1.0, 'male': 0.0, 'last': False}),
+              pd.DataFrame({'name': list(boys), 'female': 0.0, 'male': 1.0, 'last': False}),
+              pd.DataFrame({'name': list(last_names), 'female': 0.0, 'male': 0.0, 'last': True})]
+    return normalize_gender_table(pd.concat(frames, ignore_index=True))
+
+#---------------------------------------------------------------------------
+
+# <df> has 'name', 'female' and 'male' columns and optionally 'last'.
+
+def normalize_gender_table (df):
+    df = df.copy()
+    if 'last' not in df:
+        df['last'] = False
+    df['name'] = normalize_names(df['name']).values
+    df = df.loc[df['name'] != '']
+    return df.groupby('name', as_index=False).agg({'female': 'sum', 'male': 'sum', 'last': 'max'})
+
+#---------------------------------------------------------------------------
+
+# Reads the one-name-per-line files written by prepdata.py.
+
+def load_name_list (file):
+    return pd.read_csv(file, header=None, names=['name'], dtype=str,
+                       keep_default_na=False)['name']
+
+def load_prepdata_table (girls_file=None, boys_file=None, last_file=None):
+    girls_file = girls_file or join(names_dir(), 'FirstNamesGirls.csv')
+    boys_file = boys_file or join(names_dir(), 'FirstNamesBoys.csv')
+    last_file = last_file or join(names_dir(), 'LastNames.csv')
+    last_names = load_name_list(last_file) if os.path.exists(last_file) else []
+    return make_gender_table(load_name_list(girls_file), load_name_list(boys_file), last_names)
+
+#---------------------------------------------------------------------------
+# Gender Index
+#---------------------------------------------------------------------------
+
+# Binary layout (little-endian): magic, n, blob size, then n sorted uint64
+# hashes, n + 1 uint64 offsets into the blob, n float32 probabilities, n
+# uint8 flags and the utf-8 blob of normalized names.
+
+index_magic = b'GNDRIDX1'
+header_size = 24
+
+class GenderIndex:
+
+    def __init__(self, hashes, offsets, p_female, flags, blob, file=None):
+        self.hashes = hashes
+        self.offsets = offsets
+        self.p_female = p_female
+        self.flags = flags
+        self.blob = blob
+        self.file = file
+
+    def __len__(self):
+        return len(self.hashes)
+
+    # Indexes opened from a file are pickled by pathname, so sending one to
+    # worker processes maps the file again rather than copying the arrays.
+
+    def __reduce__(self):
+        if self.file is not None:
+            return (load_gender_index, (self.file,))
+        return (GenderIndex, (self.hashes, self.offsets, self.p_female,
+                              self.flags, bytes(self.blob)))
+
+    def name_at(self, position):
+        start, stop = self.offsets[position], self.offsets[position + 1]
+        return bytes(self.blob[start:stop]).decode('utf-8')
+
+    # Position of an already normalized name, or -1.
+
+    def position(self, normalized):
+        h = np.uint64(name_hash(normalized))
+        position = int(np.searchsorted(self.hashes, h))
+        if position < len(self.hashes) and self.hashes[position] == h \
+           and self.name_at(position) == normalized:
+            return position
+        return -1
+
+    def __contains__(self, name):
+        return self.position(normalize_name(name)) >= 0
+
+    # Returns (p_female, flags) for <name>, or None if unknown. p_female is
+    # NaN for names only known as last names.
+
+    def lookup(self, name):
+        position = self.position(normalize_name(name))
+        if position < 0:
+            return None
+        return float(self.p_female[position]), int(self.flags[position])
+
+    def gender(self, name, threshold=0.8):
+        result = self.lookup(name)
+        return probability_gender(np.nan if result is None else result[0], threshold)
+
+    def first_name_p(self, name):
+        result = self.lookup(name)
+        return result is not None and bool(result[1] & FIRST_NAME)
+
+    def last_name_p(self, name):
+        result = self.lookup(name)
+        return result is not None and bool(result[1] & LAST_NAME)
+
+    # Classifies a Series or array of names. Each distinct name is
+    # normalized, hashed and looked up once. Returns a DataFrame with the
+    # normalized name, p_female, flags and gender ('F', 'M' or 'U' for
+    # unknown or ambiguous at <threshold>), aligned with <names>.
+
+    def classify(self, names, threshold=0.8):
+        index = names.index if isinstance(names, pd.Series) else None
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object).fillna(''))
+        uniques = normalize_names(uniques).to_numpy()
+        positions = np.array([self.position(n) for n in uniques], dtype=np.int64)
+        found = positions >= 0
+        p_female = np.full(len(uniques), np.nan, dtype=np.float32)
+        flags = np.zeros(len(uniques), dtype=np.uint8)
+        p_female[found] = self.p_female[positions[found]]
+        flags[found] = self.flags[positions[found]]
+        p = p_female[codes]
+        gender = np.where(p >= threshold, 'F', np.where(p <= 1 - threshold, 'M', 'U'))
+        return pd.DataFrame({'name': uniques[codes], 'p_female': p,
+                             'flags': flags[codes], 'gender': gender}, index=index)
+
+    def save(self, file):
+        save_gender_index(self, file)
+
+#---------------------------------------------------------------------------
+
+def probability_gender (p, threshold=0.8):
+    if p >= threshold:
+        return 'F'
+    if p <= 1 - threshold:
+        return 'M'
+    return 'U'
+
+#---------------------------------------------------------------------------
+# Building, Saving & Loading
+#---------------------------------------------------------------------------
+
+# Compiles a gender table (see make_gender_table) into an in-memory index.
+
+def build_gender_index (table):
+    names = list(table['name'])
+    female = table['female'].to_numpy(dtype=np.float64)
+    male = table['male'].to_numpy(dtype=np.float64)
+    total = female + male
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_female = np.where(total > 0, female / total, np.nan).astype(np.float32)
+    flags = np.where(total > 0, FIRST_NAME, 0) | np.where(table['last'].to_numpy(dtype=bool), LAST_NAME, 0)
+    hashes = np.array([name_hash(n) for n in names], dtype=np.uint64)
+    if len(np.unique(hashes)) != len(hashes):
+        raise ValueError('Name hash collision while building gender index')
+    order = np.argsort(hashes, kind='stable')
+    encoded = [names[i].encode('utf-8') for i in order]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return GenderIndex(hashes[order], offsets, p_female[order],
+                       flags[order].astype(np.uint8), b''.join(encoded))
+
+#---------------------------------------------------------------------------
+
+def save_gender_index (index, file):
+    n = len(index)
+    blob = bytes(index.blob)
+    header = index_magic + np.array([n, len(blob)], dtype='<u8').tobytes()
+    with open(file, 'wb') as f:
+        f.write(header)
+        f.write(np.asarray(index.hashes, dtype='<u8').tobytes())
+        f.write(np.asarray(index.offsets, dtype='<u8').tobytes())
+        f.write(np.asarray(index.p_female, dtype='<f4').tobytes())
+        f.write(np.asarray(index.flags, dtype=np.uint8).tobytes())
+        f.write(blob)
+
+#---------------------------------------------------------------------------
+
+# Maps <file> read-only; no array is copied into memory.
+
+def load_gender_index (file=None):
+    file = file or default_index_file()
+    data = np.memmap(file, dtype=np.uint8, mode='r')
+    if bytes(data[:8]) != index_magic:
+        raise ValueError('Not a gender index file: ' + file)
+    n, blob_size = data[8:header_size].view('<u8')
+    n, blob_size = int(n), int(blob_size)
+    start = header_size
+    hashes = data[start : start + 8 * n].view('<u8')
+    start += 8 * n
+    offsets = data[start : start + 8 * (n + 1)].view('<u8')
+    start += 8 * (n + 1)
+    p_female = data[start : start + 4 * n].view('<f4')
+    start += 4 * n
+    flags = data[start : start + n]
+    start += n
+    blob = data[start : start + blob_size]
+    return GenderIndex(hashes, offsets, p_female, flags, blob, file)
+
+#---------------------------------------------------------------------------
+
+# Builds the index from the prepdata.py outputs and saves it.
+
+def compile_gender_index (index_file=None, girls_file=None, boys_file=None, last_file=None):
+    index = build_gender_index(load_prepdata_table(girls_file, boys_file, last_file))
+    save_gender_index(index, index_file or default_index_file())
+    return index
+
+#---------------------------------------------------------------------------
+# Benchmark
+#---------------------------------------------------------------------------
+
+# Load time of <index_file> and batch classification rate over <names>.
+
+def benchmark_gender_index (index_file, names, repeat=3):
+    start = time.perf_counter()
+    index = load_gender_index(index_file)
+    load_ms = (time.perf_counter() - start) * 1000
+    names = pd.Series(names)
+    start = time.perf_counter()
+    for i in range(repeat):
+        index.classify(names)
+    seconds = (time.perf_counter() - start) / repeat
+    result = {'entries': len(index), 'load_ms': round(load_ms, 3),
+              'names': len(names), 'names_per_second': int(len(names) / seconds)}
+    for k, v in result.items():
+        print (k + ': ' + str(v))
+    return result
+
+#---------------------------------------------------------------------------
+# End of File
+#---------------------------------------------------------------------------
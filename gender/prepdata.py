@@ -6,10 +6,13 @@ import os
 import sys
 import csv
 
+import numpy as np
 import pandas as pd
 from os import listdir
 from os.path import isfile, join
 
+from lastnames import load_last_names
+
 raw_names_dir =  join (os.environ['GOZUP'], '..', 'libs', 'newgender', 'rawdata')
 english_names_dir = join (raw_names_dir, 'english')
 
@@ -20,7 +23,8 @@ english_first_name_cols = ['name', 'gender', 'count']
 top_girl_names = join (english_names_dir, 'TopGirlNames1000.csv')
 top_boy_names = join (english_names_dir, 'TopBoyNames1000.csv')
 
-french_first_names = join(raw_names_dir, 'prenoms.txt')
+french_names_dir = join (raw_names_dir, 'french')
+french_first_names = join(french_names_dir, 'prenoms.csv')
 
 names_dir = join (os.environ['GOZUP'], '..', 'libs', 'newgender')
 girls_file = join(names_dir, "FirstNamesGirls.csv")
@@ -51,13 +55,29 @@ def load_files_as_df(files, cols):
 
 #---------------------------------------------------------------------------
 
+# Names and genders repeat across yearly files, so they are read as
+# categoricals: far less memory, and group-bys work on integer codes.
+
+english_first_name_dtypes = {'name': 'category', 'gender': 'category', 'count': 'int64'}
+
 def load_english_first_names ():
-    return pd.read_csv(english_first_names, names=english_first_name_cols)
+    return pd.read_csv(english_first_names, names=english_first_name_cols,
+                       dtype=english_first_name_dtypes)
 
 #---------------------------------------------------------------------------
 
+# last_names.csv has CR line endings; see lastnames.py.
+
 def load_english_last_names ():
-    return pd.read_csv(english_last_names)
+    return pd.DataFrame({'lastname': list(load_last_names(english_last_names))})
+
+#---------------------------------------------------------------------------
+
+# prenoms.csv is ';'-separated Latin-1: prenom, genre (m, f, m,f), langage
+# and fréquence. See sources.py for merging it with the English names.
+
+def load_french_first_names ():
+    return pd.read_csv(french_first_names, sep=';', encoding='latin-1')
 
 #---------------------------------------------------------------------------
 
@@ -77,30 +97,87 @@ def load_top_boy_names ():
 
 default_threshold = 1000
 
+# Total count of each name per gender, in one group-by: a DataFrame indexed
+# by name with 'F' and 'M' columns. Every function below accepts either the
+# raw first-names df or these counts, so the aggregation is done only once.
+
+def first_name_counts (df):
+    if 'gender' not in df.columns:
+        return df
+    counts = df.groupby(['name', 'gender'], observed=True)['count'].sum().unstack(fill_value=0)
+    for gender in ['F', 'M']:
+        if gender not in counts.columns:
+            counts[gender] = 0
+    counts.index = pd.Index(np.asarray(counts.index, dtype=object), name='name')
+    return counts[['F', 'M']]
+
+#---------------------------------------------------------------------------
+
 def english_names (df, gender, threshold=default_threshold):
-    gdf = df.loc[df['gender']==gender]
-    gdf = gdf.drop(['gender'], axis=1)
-    gdf = gdf.groupby(['name'], as_index=False).sum()
-    gdf = gdf.loc[gdf['count'] >= threshold]
-    return gdf.drop(['count'], axis=1)
+    counts = first_name_counts(df)
+    names = counts.index[counts[gender].to_numpy() >= threshold]
+    return pd.DataFrame({'name': names})
+
+#---------------------------------------------------------------------------
+
+# Mask of the names of <gender> at or above <threshold>, minus the top
+# names of the other gender (a Series or DataFrame with a 'name' column).
+
+def filtered_names_mask (counts, gender, excluded, threshold=default_threshold):
+    if isinstance(excluded, pd.DataFrame):
+        excluded = excluded['name']
+    return (counts[gender].to_numpy() >= threshold) & ~counts.index.isin(excluded)
 
 #---------------------------------------------------------------------------
 
 def english_girl_names(df, top_boys, threshold=default_threshold):
-    # Extract girl names from all names df.
-    all_girls =  english_names(df, 'F', threshold)
-    # Remove top boys from girls list
-    filtered_names = list(set(list(all_girls['name'])) - set(list(top_boys['name'])))
-    return pd.DataFrame (filtered_names, columns=['name'])
+    counts = first_name_counts(df)
+    names = counts.index[filtered_names_mask(counts, 'F', top_boys, threshold)]
+    return pd.DataFrame ({'name': names})
 
 #---------------------------------------------------------------------------
 
 def english_boy_names(df, top_girls, threshold=default_threshold):
-   # Extract boy names from all names df.
-    all_boys = english_names(df, 'M', threshold)
-    # Remove top boys from girls list
-    filtered_names = list(set(list(all_boys['name'])) - set(list(top_girls['name'])))
-    return pd.DataFrame (filtered_names, columns=['name'])
+    counts = first_name_counts(df)
+    names = counts.index[filtered_names_mask(counts, 'M', top_girls, threshold)]
+    return pd.DataFrame ({'name': names})
+
+#---------------------------------------------------------------------------
+
+# Girls, boys and ambiguous (in both) names for one threshold, with their
+# statistics, from a single aggregation.
+
+def english_first_name_sets (df, top_girls, top_boys, threshold=default_threshold):
+    counts = first_name_counts(df)
+    girls_mask = filtered_names_mask(counts, 'F', top_boys, threshold)
+    boys_mask = filtered_names_mask(counts, 'M', top_girls, threshold)
+    girls, boys = counts.index[girls_mask], counts.index[boys_mask]
+    ambiguous = counts.index[girls_mask & boys_mask].sort_values()
+    stats = {'threshold': threshold, 'girls': len(girls), 'boys': len(boys),
+             'ambiguous': len(ambiguous),
+             'overlap': len(ambiguous) / max(min(len(girls), len(boys)), 1)}
+    return {'girls': pd.DataFrame({'name': girls}), 'boys': pd.DataFrame({'name': boys}),
+            'ambiguous': pd.DataFrame({'name': ambiguous}), 'stats': stats}
+
+#---------------------------------------------------------------------------
+
+# Statistics of english_first_name_sets for each of <thresholds>, as a
+# DataFrame. The exclusions are applied once, so each threshold is only
+# a pair of comparisons over the count arrays.
+
+def threshold_sweep (df, top_girls, top_boys, thresholds):
+    counts = first_name_counts(df)
+    girl_counts = np.where(counts.index.isin(top_boys['name']), -1, counts['F'].to_numpy())
+    boy_counts = np.where(counts.index.isin(top_girls['name']), -1, counts['M'].to_numpy())
+    rows = []
+    for threshold in thresholds:
+        girls = girl_counts >= threshold
+        boys = boy_counts >= threshold
+        ngirls, nboys, nambiguous = int(girls.sum()), int(boys.sum()), int((girls & boys).sum())
+        rows.append({'threshold': threshold, 'girls': ngirls, 'boys': nboys,
+                     'ambiguous': nambiguous,
+                     'overlap': nambiguous / max(min(ngirls, nboys), 1)})
+    return pd.DataFrame(rows)
     
 #---------------------------------------------------------------------------
 # Save Boy & Girl Names
@@ -133,12 +210,8 @@ def test_overlap (threshold=1500):
     all_first_names = load_english_first_names()
     top_girls = load_top_girl_names ()
     top_boys = load_top_boy_names ()
-    girl_first_names = english_girl_names(all_first_names, top_boys, threshold)
-    boy_first_names = english_boy_names(all_first_names, top_girls, threshold)
-    girl_set = set(list(girl_first_names['name']))
-    boy_set = set(list(boy_first_names['name']))
-    ambi_set = list(girl_set.intersection (boy_set))
-    ambi_set.sort()
+    sets = english_first_name_sets(all_first_names, top_girls, top_boys, threshold)
+    ambi_set = list(sets['ambiguous']['name'])
     return ambi_set , len(ambi_set)
 
 #----------------------------------------------------------------------------
@@ -150,12 +223,11 @@ def main():
     all_first_names = load_english_first_names()
     top_girls = load_top_girl_names ()
     top_boys = load_top_boy_names ()
-    # Boy names
-    girl_first_names = english_girl_names(all_first_names, top_boys, threshold)
-    save_girl_names(girl_first_names)
-    # Boy names
-    boy_first_names = english_boy_names(all_first_names, top_girls, threshold)
-    save_boy_names(boy_first_names)
+    sets = english_first_name_sets(all_first_names, top_girls, top_boys, threshold)
+    # Girl & Boy names
+    save_girl_names(sets['girls'])
+    save_boy_names(sets['boys'])
+    print (sets['stats'])
     # Last names
     last_names = load_english_last_names()
     save_last_names(last_names)
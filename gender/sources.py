@@ -0,0 +1,229 @@
+#---------------------------------------------------------------------------
+# Multilingual Gender Name Sources
+#---------------------------------------------------------------------------
+
+# Each name source (a file in some language, delimiter and encoding) is
+# registered with a loader that turns it into a gender table: one row per
+# normalized name with 'female' and 'male' weights and a 'last' flag (see
+# lookup.make_gender_table). Sources are merged into one frequency-weighted
+# table: each source's weights are scaled to relative frequencies, times
+# the source weight, and summed per name.
+#
+# Parsed sources are cached as Feather files keyed on the source's mtime
+# and size, so after a change only the modified source is parsed again
+# before the merged table and the lookup index are rebuilt.
+
+import os
+import json
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+from lookup import normalize_gender_table, build_gender_index, save_gender_index
+from lastnames import iter_last_names
+
+#---------------------------------------------------------------------------
+# Files
+#---------------------------------------------------------------------------
+
+indata_dir = join(os.path.dirname(os.path.abspath(__file__)), 'indata')
+
+english_dir = join(indata_dir, 'english')
+french_dir = join(indata_dir, 'french')
+
+#---------------------------------------------------------------------------
+# Source Registry
+#---------------------------------------------------------------------------
+
+gender_sources = {}
+
+# <loader>(file, **options) returns a gender table for <file>. <weight>
+# scales the source's contribution to the merged table.
+
+def register_gender_source (name, file, loader, weight=1.0, **options):
+    gender_sources[name] = {'file': file, 'loader': loader, 'weight': weight,
+                            'options': options}
+
+def unregister_gender_source (name):
+    gender_sources.pop(name, None)
+
+#---------------------------------------------------------------------------
+# Loaders
+#---------------------------------------------------------------------------
+
+# One name per line, any line terminator (the English files use CR).
+
+def load_name_lines (file, encoding='utf-8', header=False):
+    with open(file, 'r', encoding=encoding, newline='') as f:
+        lines = f.read().splitlines()
+    if header:
+        lines = lines[1:]
+    return [line.strip() for line in lines if line.strip()]
+
+#---------------------------------------------------------------------------
+
+def gender_list_loader (gender):
+    def load (file, encoding='utf-8', header=False):
+        names = load_name_lines(file, encoding, header)
+        return pd.DataFrame({'name': names, 'female': 1.0 if gender == 'F' else 0.0,
+                             'male': 1.0 if gender == 'M' else 0.0, 'last': False})
+    return load
+
+# Terminator and encoding are detected by lastnames.iter_last_names.
+
+def load_last_name_list (file, encoding=None, header=True):
+    names = list(iter_last_names(file, header, encoding=encoding))
+    return pd.DataFrame({'name': names, 'female': 0.0, 'male': 0.0, 'last': True})
+
+#---------------------------------------------------------------------------
+
+# SSA style first names: name, gender (F/M), count, no header.
+
+def load_name_gender_counts (file, encoding='utf-8', delimiter=','):
+    df = pd.read_csv(file, sep=delimiter, encoding=encoding, header=None,
+                     names=['name', 'gender', 'count'],
+                     dtype={'name': 'category', 'gender': 'category', 'count': 'int64'})
+    counts = df.groupby(['name', 'gender'], observed=True)['count'].sum().unstack(fill_value=0)
+    return pd.DataFrame({'name': np.asarray(counts.index, dtype=object),
+                         'female': counts.get('F', 0), 'male': counts.get('M', 0),
+                         'last': False}).reset_index(drop=True)
+
+#---------------------------------------------------------------------------
+
+# prenoms.csv: 01_prenom;02_genre;03_langage;04_fréquence, ';'-separated
+# Latin-1. Genre is 'f', 'm' or both ('m,f' / 'f,m'), split evenly. Names
+# with a zero frequency still count, with <min_frequency>.
+
+def load_prenoms (file, encoding='latin-1', delimiter=';', min_frequency=0.01):
+    df = pd.read_csv(file, sep=delimiter, encoding=encoding)
+    df.columns = ['name', 'genre', 'language', 'frequency']
+    genre = df['genre'].fillna('').str.replace(' ', '')
+    female = genre.str.contains('f').astype(float)
+    male = genre.str.contains('m').astype(float)
+    share = (female + male).replace(0, np.nan)
+    frequency = df['frequency'].fillna(0).clip(lower=min_frequency)
+    return pd.DataFrame({'name': df['name'], 'female': (frequency * female / share).fillna(0),
+                         'male': (frequency * male / share).fillna(0), 'last': False})
+
+#---------------------------------------------------------------------------
+# Default Sources
+#---------------------------------------------------------------------------
+
+register_gender_source('english_top_girls', join(english_dir, 'TopGirlNames1000.csv'),
+                       gender_list_loader('F'))
+register_gender_source('english_top_boys', join(english_dir, 'TopBoyNames1000.csv'),
+                       gender_list_loader('M'))
+register_gender_source('english_last_names', join(english_dir, 'last_names.csv'),
+                       load_last_name_list)
+register_gender_source('french_prenoms', join(french_dir, 'prenoms.csv'), load_prenoms,
+                       encoding='latin-1', delimiter=';')
+
+# The full SSA first names live outside the repo, under GOZUP (see prepdata).
+
+if 'GOZUP' in os.environ:
+    register_gender_source('english_first_names',
+                           join(os.environ['GOZUP'], '..', 'libs', 'newgender', 'rawdata',
+                                'english', 'first_names.csv'),
+                           load_name_gender_counts)
+
+#---------------------------------------------------------------------------
+# Source Cache
+#---------------------------------------------------------------------------
+
+def source_signature (file):
+    stat = os.stat(file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def load_cache_manifest (cache_dir):
+    pathname = join(cache_dir, 'manifest.json')
+    if not os.path.exists(pathname):
+        return {}
+    with open(pathname, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_cache_manifest (manifest, cache_dir):
+    pathname = join(cache_dir, 'manifest.json')
+    with open(pathname + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(pathname + '.tmp', pathname)
+
+#---------------------------------------------------------------------------
+
+# Normalized gender table of one source, parsed again only if the source
+# file changed since it was cached in <cache_dir>. Without a <manifest>, the
+# one in <cache_dir> is loaded and saved; build_gender_table passes its own
+# to save it once for all sources.
+
+def load_gender_source (name, cache_dir=None, manifest=None):
+    source = gender_sources[name]
+    file = source['file']
+    if cache_dir is None:
+        return normalize_gender_table(source['loader'](file, **source['options']))
+    save = manifest is None
+    if save:
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest = load_cache_manifest(cache_dir)
+    cached = join(cache_dir, name + '.feather')
+    signature = [file] + source_signature(file)
+    if manifest.get(name) == signature and os.path.exists(cached):
+        return pd.read_feather(cached)
+    table = normalize_gender_table(source['loader'](file, **source['options']))
+    table.reset_index(drop=True).to_feather(cached)
+    manifest[name] = signature
+    if save:
+        save_cache_manifest(manifest, cache_dir)
+    return table
+
+#---------------------------------------------------------------------------
+# Merged Table
+#---------------------------------------------------------------------------
+
+# Merged, frequency-weighted gender table of <sources> (default: every
+# registered source whose file exists). Columns: name, female, male,
+# frequency, last and sources, a bitmask of the sources the name comes
+# from (bit i for the i-th registered source, see source_names).
+
+def build_gender_table (sources=None, cache_dir=None):
+    if sources is None:
+        sources = [s for s in gender_sources if os.path.exists(gender_sources[s]['file'])]
+    manifest = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest = load_cache_manifest(cache_dir)
+    tables = []
+    for name in sources:
+        table = load_gender_source(name, cache_dir, manifest).copy()
+        total = (table['female'] + table['male']).sum()
+        scale = gender_sources[name]['weight'] / total if total > 0 else 0
+        table['female'] = table['female'] * scale
+        table['male'] = table['male'] * scale
+        table['sources'] = 1 << list(gender_sources).index(name)
+        tables.append(table)
+    if cache_dir is not None:
+        save_cache_manifest(manifest, cache_dir)
+    if not tables:
+        return pd.DataFrame(columns=['name', 'female', 'male', 'frequency', 'last', 'sources'])
+    df = pd.concat(tables, ignore_index=True)
+    df = df.groupby('name', as_index=False).agg({'female': 'sum', 'male': 'sum', 'last': 'max',
+                                                 'sources': 'sum'})
+    df['frequency'] = df['female'] + df['male']
+    return df[['name', 'female', 'male', 'frequency', 'last', 'sources']]
+
+#---------------------------------------------------------------------------
+
+def source_names (mask):
+    return [name for i, name in enumerate(gender_sources) if mask & (1 << i)]
+
+#---------------------------------------------------------------------------
+
+# Builds and saves the lookup index (see lookup.py) from every source.
+
+def compile_source_index (index_file, sources=None, cache_dir=None):
+    index = build_gender_index(build_gender_table(sources, cache_dir))
+    save_gender_index(index, index_file)
+    return index
+
+#---------------------------------------------------------------------------
+# End of File
+#---------------------------------------------------------------------------
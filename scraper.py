@@ -13,27 +13,33 @@
 
 # Standard Python
 import os
+import re
 import sys
-from urllib.parse import urlparse,quote, unquote
-
-# Data Frames
-import pandas as pd
-
-# Web tools
-import requests
-from bs4 import BeautifulSoup, SoupStrainer
-
-
+import json
+import time
+import csv
+import sqlite3
+import math
+import heapq
+import base64
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse, urlunparse, quote, unquote
+
+# Heavy dependencies are imported by the functions that use them so that
+# importing this module stays cheap for short-lived workers and scripts:
+#
+# Data Frames: pandas
+# Web tools: requests, bs4 (BeautifulSoup, SoupStrainer)
+# Printing: tabulate
+#
 # NLTK Dependencies
 # Note: Need to run nltk.dowload() manually to download predefined corpuses
 # TODO: Persist corpuses to avoid manual download.
 
-import nltk
-import nltk.classify.util
-from nltk.corpus import names
-from nltk.corpus import stopwords
-from tabulate import tabulate
-
 #--------------------------------------------------------------------
 # Project Directory
 #--------------------------------------------------------------------
@@ -47,7 +53,15 @@ def get_project_dir():
 
 #-------------------------------------------------------------------------------------------
 
-PROJECT_DIR = get_project_dir()
+# PROJECT_DIR and the stopword lists are module attributes computed on first
+# access (see __getattr__ at the end of Part 0).
+
+lazy_values = {}
+
+def lazy_value (name, fn):
+    if name not in lazy_values:
+        lazy_values[name] = fn()
+    return lazy_values[name]
 
 #********************************************************************
 # Part 0: NLP Tools
@@ -68,13 +82,27 @@ PROJECT_DIR = get_project_dir()
 additional_french_stopwords = ['a', 'les', 'plus', 'comme', 'ils', 'tout', 'si', 'tous',
                                'cela', 'celle', 'celui']
 
-en_stops =  stopwords.words('english')
-fr_stops = stopwords.words('french')
+def load_stopwords (language):
+    from nltk.corpus import stopwords
+    return stopwords.words(language)
+
+def get_english_stopwords ():
+    return lazy_value('en_stops', lambda: load_stopwords('english'))
+
+def get_french_stopwords ():
+    return lazy_value('fr_stops', lambda: load_stopwords('french'))
 
-stopWords = en_stops + fr_stops + additional_french_stopwords
+def get_stopwords ():
+    return lazy_value('stopWords', lambda: get_english_stopwords() + get_french_stopwords() +
+                                           additional_french_stopwords)
 
-def show_stopwords(stopwords= stopWords):
-    for x in stopwords:
+# Hashed lookup used by the tokenizer.
+
+def get_stopword_set ():
+    return lazy_value('stopword_set', lambda: frozenset(get_stopwords()))
+
+def show_stopwords(stopwords=None):
+    for x in stopwords or get_stopwords():
         print(unquote(x))
 
 #-------------------------------------------------------------------------------------------
@@ -83,29 +111,23 @@ def show_stopwords(stopwords= stopWords):
 
 # Returns True if word only contains alpabetic characters.
 
+alphabetic_pattern = re.compile(r'[^\W\d]*$')
+
 def alphabetic_word_p(word):
-    m =  re.match(r'[^\W\d]*$', word)
-    if m == None:
-        return False
-    else:
-        return True
+    return alphabetic_pattern.match(word) is not None
 
 #-------------------------------------------------------------------------------------------
 
 # Tokenize text and apply filters.
-# TODO: Clarify logic below and use filter function from functional tools library.
 
 def tokenize_text(text, remove_stopwords=True, alphabetic_only=True ):
+    import nltk
     tokens = nltk.word_tokenize(text.lower())
-    tokensFiltered = []
-    for token in tokens:
-        alpha_word_p = alphabetic_word_p(token)
-        stop_word_p = token in stopWords
-        condition_1 = remove_stopwords==False or not stop_word_p
-        condition_2 = alphabetic_only==False or alpha_word_p
-        if condition_1 and condition_2:
-            tokensFiltered.append(token)
-    return tokensFiltered
+    match = alphabetic_pattern.match
+    stopword_set = get_stopword_set()
+    return [token for token in tokens
+            if (not remove_stopwords or token not in stopword_set)
+            and (not alphabetic_only or match(token) is not None)]
 
 #-------------------------------------------------------------------------------------------
 # Clean Sentence
@@ -117,25 +139,287 @@ def clean_sentence (s):
     tokens = tokenize_text(s)
     return ' '.join(tokens)
 
+#-------------------------------------------------------------------------------------------
+
+# Batch version of clean_sentence, same output in the same order. With
+# <workers> greater than 1 the sentences are cleaned by a process pool in
+# chunks of <chunksize>.
+
+def clean_sentences (sentences, workers=1, chunksize=500):
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(clean_sentence, sentences, chunksize=chunksize))
+    else:
+        return [clean_sentence(s) for s in sentences]
+
+#-------------------------------------------------------------------------------------------
+# Lazy Module Attributes
+#-------------------------------------------------------------------------------------------
+
+lazy_attributes = {'PROJECT_DIR': lambda: lazy_value('PROJECT_DIR', get_project_dir),
+                   'stopWords': get_stopwords,
+                   'stopword_set': get_stopword_set,
+                   'en_stops': get_english_stopwords,
+                   'fr_stops': get_french_stopwords}
+
+def __getattr__ (name):
+    if name in lazy_attributes:
+        return lazy_attributes[name]()
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
 #********************************************************************
 # Part 1: Generic web scraping tools*
 #********************************************************************
 
+#--------------------------------------------------------------------
+# HTTP Fetcher
+#--------------------------------------------------------------------
+
+# Brotli is only advertised when a decoder is installed.
+
+def get_accept_encoding ():
+    try:
+        import brotli
+        return 'gzip, deflate, br'
+    except ImportError:
+        return 'gzip, deflate'
+
+retry_status_codes = (429, 500, 502, 503, 504)
+
+#--------------------------------------------------------------------
+# On-disk Response Cache
+#--------------------------------------------------------------------
+
+# SQLite response cache keyed by normalized URL. Bodies are stored once per
+# SHA-256 content hash, so identical pages share storage.
+#
+# ttl: seconds an entry is served without going to the network. Stale
+#      entries are revalidated with their ETag/Last-Modified; a 304 keeps
+#      the stored body. None means entries never expire.
+# max_size: cap in bytes on stored bodies; least recently used URLs are
+#           evicted first. None means no cap.
+# offline: replay only. Entries are served whatever their age and misses
+#          return None without any network I/O.
+
+class ResponseCache:
+
+    def __init__(self, file, ttl=None, max_size=None, offline=False):
+        self.file = file
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS bodies '
+                        '(hash TEXT PRIMARY KEY, content BLOB, size INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS urls '
+                        '(url TEXT PRIMARY KEY, hash TEXT, status INTEGER, headers TEXT, '
+                        'etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS urls_accessed ON urls (accessed_at)')
+        self.db.commit()
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+
+    # Returns the cache entry of <url> as a dict, or None.
+
+    def lookup(self, url):
+        key = normalize_url(url)
+        with self.lock:
+            row = self.db.execute('SELECT u.status, u.headers, u.etag, u.last_modified, '
+                                  'u.fetched_at, b.content FROM urls u '
+                                  'JOIN bodies b ON u.hash = b.hash WHERE u.url = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE urls SET accessed_at = ? WHERE url = ?', (time.time(), key))
+            self.db.commit()
+        return {'url': url, 'status': row[0], 'headers': json.loads(row[1]),
+                'etag': row[2], 'last_modified': row[3], 'fetched_at': row[4],
+                'content': row[5]}
+
+    def fresh_p(self, entry):
+        return self.ttl is None or time.time() - entry['fetched_at'] < self.ttl
+
+    def store(self, url, response):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        now = time.time()
+        key = normalize_url(url)
+        with self.lock:
+            previous = self.db.execute('SELECT hash FROM urls WHERE url = ?', (key,)).fetchone()
+            if self.db.execute('SELECT 1 FROM bodies WHERE hash = ?', (digest,)).fetchone() is None:
+                self.db.execute('INSERT INTO bodies VALUES (?, ?, ?)',
+                                (digest, content, len(content)))
+                self.size += len(content)
+            self.db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (key, digest, response.status_code,
+                             json.dumps(dict(response.headers)),
+                             response.headers.get('ETag'),
+                             response.headers.get('Last-Modified'), now, now))
+            # A changed page no longer references its old body.
+            if previous is not None and previous[0] != digest:
+                self.release_body(previous[0])
+            self.evict()
+            self.db.commit()
+
+    # Marks a revalidated entry as freshly fetched.
+
+    def touch(self, url):
+        with self.lock:
+            self.db.execute('UPDATE urls SET fetched_at = ? WHERE url = ?',
+                            (time.time(), normalize_url(url)))
+            self.db.commit()
+
+    # Deletes the body <digest> if no URL references it. Called with the
+    # lock held.
+
+    def release_body(self, digest):
+        if self.db.execute('SELECT 1 FROM urls WHERE hash = ?', (digest,)).fetchone() is None:
+            size = self.db.execute('SELECT size FROM bodies WHERE hash = ?', (digest,)).fetchone()
+            self.db.execute('DELETE FROM bodies WHERE hash = ?', (digest,))
+            self.size -= size[0] if size else 0
+
+    # Called with the lock held.
+
+    def evict(self):
+        while self.max_size is not None and self.size > self.max_size:
+            rows = self.db.execute('SELECT url, hash FROM urls ORDER BY accessed_at LIMIT 100').fetchall()
+            if not rows:
+                break
+            for url, digest in rows:
+                self.db.execute('DELETE FROM urls WHERE url = ?', (url,))
+                self.release_body(digest)
+                if self.size <= self.max_size:
+                    break
+
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM urls')
+            self.db.execute('DELETE FROM bodies')
+            self.db.commit()
+            self.size = 0
+
+    def close(self):
+        self.db.close()
+
+#--------------------------------------------------------------------
+
+# Rebuilds a requests Response from a cache entry.
+
+def make_cached_response (entry):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response._content = entry['content']
+    response.url = entry['url']
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+#--------------------------------------------------------------------
+
+# A shared requests session with pooled keep-alive connections per host,
+# connect/read timeouts and retries with exponential backoff.
+#
+# cache: optional ResponseCache consulted before the network. Conditional
+# requests (If-None-Match / If-Modified-Since) are only sent through the
+# cache, which keeps the body to serve when the server answers 304; a bare
+# fetcher has no body to fall back to, so it always fetches in full.
+
+class Fetcher:
+
+    def __init__(self, timeout=(5, 30), retries=3, backoff_factor=0.5,
+                 pool_connections=10, pool_maxsize=16, headers={}, cache=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': get_accept_encoding()})
+        self.session.headers.update(headers)
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=retry_status_codes,
+                      allowed_methods=['GET', 'HEAD'],
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, headers={}):
+        if self.cache is not None:
+            return self.cached_get(url, headers)
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+    # Serves fresh entries from the cache, revalidates stale ones and stores
+    # new 200 responses. Returns None on a miss in offline mode.
+
+    def cached_get(self, url, headers={}):
+        entry = self.cache.lookup(url)
+        if entry is not None and (self.cache.offline or self.cache.fresh_p(entry)):
+            return make_cached_response(entry)
+        if self.cache.offline:
+            return None
+        headers = dict(headers)
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(url)
+            return make_cached_response(entry)
+        if response.status_code == 200:
+            self.cache.store(url, response)
+        return response
+
+    def close(self):
+        self.session.close()
+
+#--------------------------------------------------------------------
+
+# The fetcher used when none is passed explicitly. Created on first use.
+
+default_fetcher = None
+
+def get_fetcher ():
+    global default_fetcher
+    if default_fetcher is None:
+        default_fetcher = Fetcher()
+    return default_fetcher
+
+def set_fetcher (fetcher):
+    global default_fetcher
+    default_fetcher = fetcher
+    return fetcher
+
+# Routes all default fetches through an on-disk ResponseCache.
+
+def use_response_cache (file, ttl=None, max_size=None, offline=False):
+    return set_fetcher(Fetcher(cache=ResponseCache(file, ttl, max_size, offline)))
+
+#--------------------------------------------------------------------
+
 # Returns a response object
 
-def get_url_response (url):
+def get_url_response (url, fetcher=None):
     try:
-        return requests.get(url)
+        return (fetcher or get_fetcher()).get(url)
     except Exception:
         return None
 
 #--------------------------------------------------------------------
 
-# Extracts the content of the response of a request.
+# Extracts the content of the response of a request. A 304 (not modified)
+# response has no new content and returns None.
 
-def get_url_data (url):
-    response = get_url_response(url)
-    if response==None:
+def get_url_data (url, fetcher=None):
+    response = get_url_response(url, fetcher)
+    if response is None or response.status_code == 304:
         return None
     else:
         return response.content
@@ -180,25 +464,120 @@ def make_domain_url (url):
 def internal_link_p (url, site_url):
     return same_domain_p (url, site_url)
 
+#--------------------------------------------------------------------
+
+# URL normalization: lowercase scheme and host, drop default ports and
+# fragments, and use '/' for an empty path so that equivalent links map to
+# a single frontier entry.
+
+default_ports = {'http': 80, 'https': 443}
+
+def normalize_url (url):
+    comps = urlparse(url.strip())
+    scheme = comps.scheme.lower()
+    netloc = comps.netloc.lower()
+    if comps.port is not None and default_ports.get(scheme) == comps.port:
+        netloc = netloc.rsplit(':', 1)[0]
+    path = comps.path or '/'
+    return urlunparse((scheme, netloc, path, comps.params, comps.query, ''))
+
 #--------------------------------------------------------------------
 # URL Extraction.
 #--------------------------------------------------------------------
 
-def extract_urls (url, filter='', stop_words=[]):
-    response = get_url_response(url)
-    urls = []
-    if response is not None:
-        soup = BeautifulSoup(response.content, 'lxml')
-        for link in soup.find_all('a', href=True):
-            if filter in link['href'] and not link_contains_stop_word (link, stop_words):
-                urls.append(unquote(link['href']))
-                urls = list(set(urls))
-    return urls
+#--------------------------------------------------------------------
+# Single-parse Extraction
+#--------------------------------------------------------------------
+
+# Strainers restrict tree construction to the elements that are used, so
+# the rest of the DOM is never materialized as BeautifulSoup objects.
+
+def get_strainer (name):
+    def make_strainers ():
+        from bs4 import SoupStrainer
+        return {'text': SoupStrainer('p'),
+                'link': SoupStrainer('a', href=True),
+                'page': SoupStrainer(['p', 'a'])}
+    return lazy_value('strainers', make_strainers)[name]
+
+# Parses <content> keeping only what <strainer> matches.
+
+def make_strained_soup (content, strainer):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, 'lxml', parse_only=get_strainer(strainer))
 
 #--------------------------------------------------------------------
 
-def extract_full_urls(url, root_url, filter='', stop_words=[]):
-    urls = extract_urls(url, filter, stop_words)
+def soup_text (soup):
+    text = [x.get_text() for x in soup.find_all('p')]
+    return [unquote(x) for x in text if len(x) > 2]
+
+def soup_urls (soup, filter='', stop_words=[]):
+    urls = set()
+    for link in soup.find_all('a', href=True):
+        if filter in link['href'] and not link_contains_stop_word (link, stop_words):
+            urls.add(unquote(link['href']))
+    return list(urls)
+
+#--------------------------------------------------------------------
+
+# Same extraction on a raw lxml tree, without BeautifulSoup objects.
+# Bytes that decode as UTF-8 are parsed as UTF-8, others are left to the
+# document's own charset declaration.
+
+def lxml_content (content, filter='', stop_words=[]):
+    import lxml.html
+    try:
+        content.decode('utf-8')
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+    except UnicodeDecodeError:
+        parser = lxml.html.HTMLParser()
+    doc = lxml.html.document_fromstring(content, parser=parser)
+    text = []
+    urls = set()
+    for element in doc.iter('p', 'a'):
+        if element.tag == 'p':
+            text.append(element.text_content())
+        else:
+            href = element.get('href')
+            if href is not None and filter in href and \
+               not link_contains_stop_word({'href': href}, stop_words):
+                urls.add(unquote(href))
+    return [unquote(x) for x in text if len(x) > 2], list(urls)
+
+#--------------------------------------------------------------------
+
+# Parses a fetched page once and returns both its paragraph text and its
+# unique links. engine is 'soup' (strained BeautifulSoup, same results as
+# extract_content_text and extract_content_urls) or 'lxml' (faster).
+
+def extract_content (content, filter='', stop_words=[], engine='soup'):
+    if not content:
+        return [], []
+    elif engine == 'lxml':
+        return lxml_content(content, filter, stop_words)
+    else:
+        soup = make_strained_soup(content, 'page')
+        return soup_text(soup), soup_urls(soup, filter, stop_words)
+
+#--------------------------------------------------------------------
+
+# Returns the unique links of an already fetched page.
+
+def extract_content_urls (content, filter='', stop_words=[]):
+    if not content:
+        return []
+    soup = make_strained_soup(content, 'link')
+    return soup_urls(soup, filter, stop_words)
+
+#--------------------------------------------------------------------
+
+def extract_urls (url, filter='', stop_words=[], fetcher=None):
+    return extract_content_urls(get_url_data(url, fetcher), filter, stop_words)
+
+#--------------------------------------------------------------------
+
+def make_full_urls (urls, root_url):
     full_urls = []
     for u in urls:
         if not full_url_p(u):
@@ -207,6 +586,12 @@ def extract_full_urls(url, root_url, filter='', stop_words=[]):
             full_url = u
         full_urls.append(full_url)
     return full_urls
+
+#--------------------------------------------------------------------
+
+def extract_full_urls(url, root_url, filter='', stop_words=[]):
+    urls = extract_urls(url, filter, stop_words)
+    return make_full_urls(urls, root_url)
  
 #--------------------------------------------------------------------
 
@@ -220,29 +605,36 @@ def extract_internal_urls(url, root_url, filter='', stop_words=[]):
 
 #--------------------------------------------------------------------
 
-def extract_text(url):
-    content = get_url_data(url)
-    text = []
-    if content is not None:
-        soup = BeautifulSoup(content, 'lxml')
-        for x in soup.find_all('p'):
-            text.append(x.get_text())
-        text = [unquote(x)  for x in text if len(x) > 2]
-    return text
+# Returns the paragraph text of an already fetched page.
+
+def extract_content_text(content):
+    if not content:
+        return []
+    return soup_text(make_strained_soup(content, 'text'))
 
 #--------------------------------------------------------------------
 
-def extract_clean_text (url):
-    text = extract_text(url)
-    clean = [clean_sentence(x) for x in text]
+def extract_text(url, fetcher=None):
+    return extract_content_text(get_url_data(url, fetcher))
+
+#--------------------------------------------------------------------
+
+def clean_text (text):
+    clean = clean_sentences(text)
     filtered = [x for x in clean if len(x.split(' ')) > 1]
     return filtered
 
+#--------------------------------------------------------------------
+
+def extract_clean_text (url):
+    return clean_text(extract_text(url))
+
 #********************************************************************
 # Part 2: CRIF scraping tools
 #********************************************************************
 
-def make_scrapesites_pathname (file, dir=PROJECT_DIR):
+def make_scrapesites_pathname (file, dir=None):
+    dir = dir or lazy_attributes['PROJECT_DIR']()
     return ct.make_crif_pathname(file, 'scrapesites', dir)
 
 #-------------------------------------------------------------------------------------------
@@ -283,9 +675,10 @@ def load_websites_file (websites_file='websites_list.xlsx'):
 #------------------------------------------------------------------------------------------
 
 def save_websites_sentences (rows, file):
+    import pandas as pd
     pathname = ct.make_local_data_pathname(file)
     df = pd.DataFrame(rows, columns=scraper_output_columns)
-    return ct.save_excel_file (df, file)
+    return ct.save_excel_file (df, pathname)
 
 #------------------------------------------------------------------------------------------
 
@@ -299,42 +692,450 @@ def make_webite_sentences_pathname (file_name, suffix):
 # This saves the sentences for a particular website in Excel format
 
 def save_website_sentences (rows, filename, count=0):
+    import pandas as pd
     pathname = make_webite_sentences_pathname (filename, '_' + str(count))
     df = pd.DataFrame(rows, columns=scraper_output_columns)
     return ct.save_excel_file (df, pathname)
 
 #------------------------------------------------------------------------------------------
 
+#------------------------------------------------------------------------------------------
+# Sentence Sinks
+#------------------------------------------------------------------------------------------
+
+# A sink receives the output rows of each website as they are produced:
+# write(rows, count) takes any iterable of rows, possibly in several calls
+# per website, where <count> is the website's row number in the websites
+# file, and returns the number of rows written. finish(count) is called once
+# the website is complete. Rows are not kept once written.
+
+# With <append>, an existing store is extended rather than replaced, as when
+# resuming a run. discard keeps only the rows of the given websites, to drop
+# partial output of websites that did not complete. drop(count) removes the
+# rows of one website that failed, instead of finishing it.
+
+class SentenceSink:
+
+    def __init__(self, pathname, append=False):
+        self.pathname = pathname
+        self.append = append
+        self.count = 0
+
+    def write(self, rows, count=0):
+        n = 0
+        for row in rows:
+            n += 1
+        self.count += n
+        return n
+
+    def finish(self, count):
+        pass
+
+    def discard(self, completed):
+        pass
+
+    def drop(self, count):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+#------------------------------------------------------------------------------------------
+
+# The historical format: one website_sentences_<count>.xlsx shard per website,
+# merged afterwards by merge_websites_files. An Excel shard can only be
+# written whole, so the rows of each website are held until finish.
+
+class ExcelShardSink(SentenceSink):
+
+    def __init__(self, pathname, append=False):
+        SentenceSink.__init__(self, pathname, append)
+        self.websites = {}
+
+    def write(self, rows, count=0):
+        rows = list(rows)
+        self.websites.setdefault(count, []).extend(rows)
+        self.count += len(rows)
+        return len(rows)
+
+    def finish(self, count):
+        save_website_sentences (self.websites.pop(count, []), self.pathname, count=count)
+
+    # A shard left by an earlier run is removed too, or it would be merged.
+
+    def drop(self, count):
+        self.websites.pop(count, None)
+        shard = make_webite_sentences_pathname(self.pathname, '_' + str(count))
+        if os.path.isfile(shard):
+            os.remove(shard)
+
+#------------------------------------------------------------------------------------------
+
+# Text stores rewritten to keep only the lines of <completed> websites.
+
+def filter_store_lines (pathname, keep_p, header=False):
+    if not os.path.isfile(pathname):
+        return
+    temp = pathname + '.tmp'
+    with open(pathname, 'r', newline='', encoding='utf-8') as infile:
+        with open(temp, 'w', newline='', encoding='utf-8') as outfile:
+            if header:
+                outfile.write(infile.readline())
+            outfile.writelines([line for line in infile if keep_p(line)])
+    os.replace(temp, pathname)
+
+#------------------------------------------------------------------------------------------
+
+# Website row number of a JSON Lines store line, or None for a line that
+# does not parse, such as one left half-written by a crash.
+
+def json_line_website (line):
+    try:
+        return json.loads(line)['website']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+#------------------------------------------------------------------------------------------
+
+# Each line also carries the website row number under 'website'.
+
+class JsonLinesSink(SentenceSink):
+
+    def __init__(self, pathname, append=False):
+        SentenceSink.__init__(self, pathname, append)
+        self.file = open(pathname, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, rows, count=0):
+        n = 0
+        for row in rows:
+            entry = dict(zip(scraper_output_columns, row))
+            entry['website'] = count
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            n += 1
+        self.count += n
+        return n
+
+    def filter(self, keep_p):
+        self.file.close()
+        filter_store_lines(self.pathname, lambda line: keep_p(json_line_website(line)))
+        self.file = open(self.pathname, 'a', encoding='utf-8')
+
+    def discard(self, completed):
+        completed = set(completed)
+        self.filter(lambda website: website in completed)
+
+    def drop(self, count):
+        self.filter(lambda website: website is not None and website != count)
+
+    def close(self):
+        self.file.close()
+
+#------------------------------------------------------------------------------------------
+
+# The last column holds the website row number. Sentences never contain
+# newlines (clean_sentence joins tokens with spaces), so each row is a line.
+
+class CsvSink(SentenceSink):
+
+    def __init__(self, pathname, append=False):
+        SentenceSink.__init__(self, pathname, append)
+        new_file = not append or not os.path.isfile(pathname)
+        self.file = open(pathname, 'w' if new_file else 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(scraper_output_columns + ['website'])
+
+    def write(self, rows, count=0):
+        n = 0
+        for row in rows:
+            self.writer.writerow(list(row) + [count])
+            n += 1
+        self.count += n
+        return n
+
+    def filter(self, keep_p):
+        self.file.close()
+        filter_store_lines(self.pathname, lambda line: keep_p(line.rstrip('\r\n').rsplit(',', 1)[-1]),
+                           header=True)
+        self.file = open(self.pathname, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+
+    def discard(self, completed):
+        completed = set([str(c) for c in completed])
+        self.filter(lambda website: website in completed)
+
+    def drop(self, count):
+        self.filter(lambda website: website != str(count))
+
+    def close(self):
+        self.file.close()
+
+#------------------------------------------------------------------------------------------
+
+# SQLite store in WAL mode. Rows are inserted with executemany in batches of
+# <batch_size>, one transaction per batch.
+
+class SqliteSink(SentenceSink):
+
+    def __init__(self, pathname, append=False, batch_size=10000):
+        SentenceSink.__init__(self, pathname, append)
+        self.batch_size = batch_size
+        self.batch = []
+        self.db = sqlite3.connect(pathname)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        if not append:
+            self.db.execute('DROP TABLE IF EXISTS sentences')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sentences (' +
+                        ', '.join([c + ' TEXT' for c in scraper_output_columns]) +
+                        ', website INTEGER)')
+        self.db.commit()
+
+    def flush(self):
+        if self.batch:
+            self.db.executemany('INSERT INTO sentences VALUES (?, ?, ?, ?, ?, ?)', self.batch)
+            self.db.commit()
+            self.batch = []
+
+    def write(self, rows, count=0):
+        n = 0
+        for row in rows:
+            self.batch.append([str(x) for x in row] + [count])
+            n += 1
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+        self.count += n
+        return n
+
+    def discard(self, completed):
+        self.flush()
+        marks = ', '.join(['?'] * len(completed))
+        self.db.execute('DELETE FROM sentences WHERE website NOT IN (' + marks + ')',
+                        list(completed))
+        self.db.commit()
+
+    def drop(self, count):
+        self.flush()
+        self.db.execute('DELETE FROM sentences WHERE website = ?', (count,))
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+#------------------------------------------------------------------------------------------
+
+sentence_sinks = {'excel': ['.xlsx', ExcelShardSink],
+                  'jsonl': ['.jsonl', JsonLinesSink],
+                  'csv': ['.csv', CsvSink],
+                  'sqlite': ['.db', SqliteSink]}
+
+# Returns a sink of type <sink> for <sentences_file>. Except for 'excel', the
+# extension of <sentences_file> is replaced by the sink's own.
+
+def make_sentence_sink (sink, sentences_file, append=False):
+    ext, sink_class = sentence_sinks[sink]
+    if sink == 'excel':
+        return sink_class(sentences_file, append)
+    name = os.path.splitext(os.path.basename(sentences_file))[0]
+    return sink_class(ct.make_local_data_pathname(name + ext), append)
+
+#------------------------------------------------------------------------------------------
+
+# Reads a JSON Lines, CSV or SQLite sentence store back into a DataFrame with
+# the scraper output columns.
+
+def load_sentence_store (pathname):
+    import pandas as pd
+    ext = os.path.splitext(pathname)[1].lower()
+    if ext == '.jsonl':
+        # An empty store, e.g. when every website failed, has no columns.
+        df = pd.read_json(pathname, lines=True, dtype=False)
+        return df.reindex(columns=scraper_output_columns)
+    elif ext == '.db':
+        db = sqlite3.connect(pathname)
+        try:
+            return pd.read_sql_query('SELECT ' + ', '.join(scraper_output_columns) +
+                                     ' FROM sentences', db)
+        finally:
+            db.close()
+    else:
+        return pd.read_csv(pathname, usecols=scraper_output_columns)[scraper_output_columns]
+
+#------------------------------------------------------------------------------------------
+
+# Optional final step: exports a sentence store to a single Excel file.
+
+def export_sentence_store_to_excel (pathname, excel_file):
+    return save_websites_sentences (load_sentence_store(pathname).values.tolist(), excel_file)
+
+#------------------------------------------------------------------------------------------
+
 websites_sentences_file = 'websites_sentences.csv'
 
-# This loads the sentences for all websites from a csv file.
+# Merged output format, from the extension of the output file: 'csv' (a
+# single file), or 'parquet' / 'feather' (a directory of one partition per
+# website shard).
+
+def merged_output_format (file):
+    ext = os.path.splitext(file)[1].lower()
+    if ext == '.parquet':
+        return 'parquet'
+    elif ext in ('.feather', '.arrow'):
+        return 'feather'
+    elif ext in ('.jsonl', '.db'):
+        return 'store'
+    else:
+        return 'csv'
+
+#------------------------------------------------------------------------------------------
+
+# This loads the sentences for all websites from the merged file, or from a
+# JSON Lines or SQLite sentence store, whose columns are swapped the same way
+# merge_websites_files swaps them.
 
 def load_websites_sentences (websites_file=websites_sentences_file):
+    import pandas as pd
     pathname = ct.make_local_data_pathname (websites_file)
-    df = pd.read_csv (pathname)
+    format = merged_output_format(websites_file)
+    if format == 'store':
+        df = swap_source_text(load_sentence_store(pathname))
+    elif format == 'parquet':
+        df = pd.read_parquet (pathname)
+    elif format == 'feather':
+        parts = sorted(os.listdir(pathname))
+        df = pd.concat([pd.read_feather(os.path.join(pathname, p)) for p in parts],
+                       ignore_index=True)
+    else:
+        df = pd.read_csv (pathname)
     return df
 
 #------------------------------------------------------------------------------------------
+# Incremental Merge
+#------------------------------------------------------------------------------------------
+
+# The manifest records, for each merged shard, its mtime, size and content
+# hash. A shard whose mtime or size changed is only considered modified if
+# its hash changed too.
+
+def load_merge_manifest (pathname):
+    if not os.path.isfile(pathname):
+        return {}
+    with open(pathname, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-def merge_websites_files(output_file=websites_sentences_file):
+def save_merge_manifest (manifest, pathname):
+    with open(pathname, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    return True
+
+def shard_signature (file):
+    st = os.stat(file)
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            digest.update(block)
+    return {'mtime': st.st_mtime, 'size': st.st_size, 'hash': digest.hexdigest()}
+
+def shard_unchanged_p (file, entry):
+    st = os.stat(file)
+    if entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+        return True
+    return shard_signature(file)['hash'] == entry['hash']
+
+#------------------------------------------------------------------------------------------
+
+# HACK: Cleanup column names. Shards hold 'website' under 'source' and the
+# sentence under 'text', while the merged file has always carried them the
+# other way round, so the two are swapped as each shard is merged.
+
+def swap_source_text (df):
+    columns = list(df.columns)
+    return df.rename(columns={'source': 'text', 'text': 'source'})[columns]
+
+# Shards are named <sentences file>_<count>.xlsx by save_website_sentences.
+
+website_shard_pattern = re.compile(r'website_sentences.*_\d+\.xlsx?$')
+
+def load_website_shard (file):
+    import pandas as pd
+    return swap_source_text(pd.DataFrame(ct.load_excel_file(file)))
+
+def shard_partition_pathname (output_pathname, file, format):
+    name = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(output_pathname, name + '.' + format)
+
+#------------------------------------------------------------------------------------------
+
+# Merges the website_sentences shards into <output_file>. Only shards that
+# are not yet in the manifest, or whose content changed, are read. For a
+# CSV output new shards are appended, and a changed or removed shard forces
+# a full rebuild. For Parquet/Feather outputs each shard is its own
+# partition, so changed shards are rewritten and removed ones deleted.
+# <incremental>=False, or a missing manifest, rebuilds from scratch. JSON Lines and SQLite
+# files are sentence stores written by the sinks, not merge outputs.
+
+def merge_websites_files(output_file=websites_sentences_file, incremental=True):
+    import pandas as pd
+    format = merged_output_format(output_file)
+    if format == 'store':
+        raise ValueError("Merged output must be CSV, Parquet or Feather: " + str(output_file))
     print ("Merging website files into big data...")
     dir = ct.make_local_data_pathname('')
     files = ct.files_in_dir(dir)
-    files = [f for f in files if 'website_sentences' in f]
-    full_df = pd.DataFrame(ct.load_excel_file(files[0]))
-    
-    for f in files[1:]:
-        df = pd.DataFrame(ct.load_excel_file(f))
-        full_df = pd.concat([full_df, df], axis=0)
-        
-    # HACK: Cleanup column names:
-    full_df['temp'] = full_df['source']
-    full_df['source'] = full_df['text']
-    full_df['text'] = full_df['temp']
-    full_df = full_df.drop(['temp'], axis=1)
-    
+    files = sorted([f for f in files if website_shard_pattern.search(os.path.basename(f))])
     output_pathname = ct.make_local_data_pathname(output_file)
-    full_df.to_csv(output_pathname, encoding='utf-8', index=False)
+    manifest_pathname = output_pathname + '.manifest.json'
+
+    manifest = {}
+    if incremental and os.path.exists(output_pathname):
+        manifest = load_merge_manifest(manifest_pathname)
+    stale = [f for f in manifest if f not in files or not shard_unchanged_p(f, manifest[f])]
+    new_files = [f for f in files if f not in manifest or f in stale]
+
+    if format == 'csv':
+        if stale or not manifest:
+            manifest = {}
+            new_files = files
+            if os.path.exists(output_pathname):
+                os.remove(output_pathname)
+        if new_files:
+            df = pd.concat([load_website_shard(f) for f in new_files], axis=0)
+            df.to_csv(output_pathname, mode='a', encoding='utf-8', index=False,
+                      header=not os.path.exists(output_pathname))
+    else:
+        os.makedirs(output_pathname, exist_ok=True)
+        if not manifest:
+            # Full rebuild: partitions of shards that no longer exist go too.
+            partitions = [shard_partition_pathname(output_pathname, f, format) for f in files]
+            for name in os.listdir(output_pathname):
+                partition = os.path.join(output_pathname, name)
+                if name.endswith('.' + format) and partition not in partitions:
+                    os.remove(partition)
+        for f in stale:
+            if f not in files:
+                partition = shard_partition_pathname(output_pathname, f, format)
+                if os.path.exists(partition):
+                    os.remove(partition)
+                del manifest[f]
+        for f in new_files:
+            df = load_website_shard(f).reset_index(drop=True)
+            partition = shard_partition_pathname(output_pathname, f, format)
+            if format == 'parquet':
+                df.to_parquet(partition, index=False)
+            else:
+                df.to_feather(partition)
+
+    for f in new_files:
+        manifest[f] = shard_signature(f)
+    save_merge_manifest(manifest, manifest_pathname)
+    print ("Website files merged: " + str(len(new_files)) + " of " + str(len(files)))
     #ct.save_excel_file(full_df, output_pathname)
     return True
 
@@ -365,36 +1166,346 @@ def limit_reached_p (n, limit):
         return False
 #------------------------------------------------------------------------------------------
 
-def crawl_website (root_url, limit=5000):
+# Fixed-size Bloom filter used as a bounded-memory visited set. Sized for
+# <capacity> entries at a false positive rate of <error_rate>. A false positive
+# means a page is considered already seen and is skipped.
+
+class BloomFilter:
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for p in self.positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(item))
+
+    def __len__(self):
+        return self.count
+
+    def get_state(self):
+        return {'size': self.size, 'hash_count': self.hash_count, 'count': self.count,
+                'bits': base64.b64encode(bytes(self.bits)).decode('ascii')}
+
+    def set_state(self, state):
+        self.size = state['size']
+        self.hash_count = state['hash_count']
+        self.count = state['count']
+        self.bits = bytearray(base64.b64decode(state['bits']))
+
+#------------------------------------------------------------------------------------------
+
+# Crawl frontier. Every URL is normalized and checked against a single seen
+# set (visited and queued URLs alike) so each page is queued at most once.
+#
+# order: 'dfs' (last in, first out, the historical crawl order) or 'bfs'.
+# priority: optional function of a URL; lower values are crawled first and
+#           <order> is then only used to break ties.
+# bloom_capacity: when set, the seen set is a BloomFilter of that capacity.
+
+class CrawlFrontier:
+
+    def __init__(self, order='dfs', priority=None, bloom_capacity=None, error_rate=0.001):
+        if order not in ('dfs', 'bfs'):
+            raise ValueError("Unknown frontier order: " + str(order))
+        self.order = order
+        self.priority = priority
+        if bloom_capacity is None:
+            self.seen = set()
+        else:
+            self.seen = BloomFilter(bloom_capacity, error_rate)
+        self.queue = deque()
+        self.heap = []
+        self.counter = 0
+
+    # Returns True if <url> was new and has been queued.
+
+    def add(self, url):
+        url = normalize_url(url)
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+        if self.priority is None:
+            self.queue.append(url)
+        else:
+            self.counter += 1
+            tie = -self.counter if self.order == 'dfs' else self.counter
+            heapq.heappush(self.heap, (self.priority(url), tie, url))
+        return True
+
+    def extend(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def pop(self):
+        if self.priority is not None:
+            return heapq.heappop(self.heap)[2]
+        elif self.order == 'dfs':
+            return self.queue.pop()
+        else:
+            return self.queue.popleft()
+
+    def seen_p(self, url):
+        return normalize_url(url) in self.seen
+
+    def mark_seen(self, url):
+        url = normalize_url(url)
+        if url not in self.seen:
+            self.seen.add(url)
+
+    # Drops <urls> from the queue, e.g. pages already crawled before a resume.
+
+    def discard(self, urls):
+        urls = set([normalize_url(u) for u in urls])
+        self.queue = deque([u for u in self.queue if u not in urls])
+        self.heap = [entry for entry in self.heap if entry[2] not in urls]
+        heapq.heapify(self.heap)
+
+    # JSON-serializable state. <pending> URLs (popped but not yet crawled) are
+    # put back so that they are popped first after a restore.
+
+    def get_state(self, pending=[]):
+        queue = list(self.queue)
+        heap = [list(entry) for entry in self.heap]
+        first = min([entry[1] for entry in self.heap], default=0)
+        for url in pending:
+            if self.priority is not None:
+                first -= 1
+                heap.append([self.priority(url), first, url])
+            elif self.order == 'dfs':
+                queue.append(url)
+            else:
+                queue.insert(0, url)
+        if isinstance(self.seen, BloomFilter):
+            seen = self.seen.get_state()
+        else:
+            seen = list(self.seen)
+        return {'order': self.order, 'queue': queue, 'heap': heap,
+                'counter': self.counter, 'seen': seen}
+
+    def set_state(self, state):
+        self.order = state['order']
+        self.queue = deque(state['queue'])
+        self.heap = [tuple(entry) for entry in state['heap']]
+        heapq.heapify(self.heap)
+        self.counter = state['counter']
+        if isinstance(state['seen'], dict):
+            self.seen = BloomFilter(1)
+            self.seen.set_state(state['seen'])
+        else:
+            self.seen = set(state['seen'])
+
+    def __len__(self):
+        return len(self.heap) if self.priority is not None else len(self.queue)
+
+#------------------------------------------------------------------------------------------
+# Crawl Checkpoints
+#------------------------------------------------------------------------------------------
+
+# Writes <obj> as JSON through a temporary file, so a crash never leaves a
+# truncated file behind.
+
+def save_json_atomic (obj, pathname):
+    temp = pathname + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f)
+    os.replace(temp, pathname)
+    return True
+
+#------------------------------------------------------------------------------------------
+
+# Crawl state kept in directory <dir>:
+#
+# pages.jsonl: one line per crawled page with its url, clean text and links,
+#              appended as each page completes. This is the record of what
+#              has been fetched.
+# frontier.json: frontier snapshot (queue, seen set, in-flight pages),
+#                rewritten every <interval> pages and at the end of a crawl.
+#
+# On resume the snapshot is restored, then every logged page is marked seen,
+# its links are queued again (the seen set makes this idempotent) and it is
+# dropped from the queue, so no completed page is fetched twice.
+
+class CrawlCheckpoint:
+
+    def __init__(self, dir, interval=100):
+        os.makedirs(dir, exist_ok=True)
+        self.pages_file = os.path.join(dir, 'pages.jsonl')
+        self.frontier_file = os.path.join(dir, 'frontier.json')
+        self.interval = interval
+        self.since_save = 0
+        self.log = None
+
+    # Restores <frontier> and returns the [url, text] results already crawled.
+
+    def load(self, frontier):
+        if os.path.isfile(self.frontier_file):
+            with open(self.frontier_file, 'r', encoding='utf-8') as f:
+                frontier.set_state(json.load(f))
+        results = []
+        if os.path.isfile(self.pages_file):
+            with open(self.pages_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        page = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by the crash
+                        continue
+                    results.append([page['url'], page['text']])
+                    frontier.mark_seen(page['url'])
+                    frontier.extend(page['links'])
+        frontier.discard([url for url, text in results])
+        return results
+
+    def open(self, resume=False):
+        self.log = open(self.pages_file, 'a' if resume else 'w', encoding='utf-8')
+
+    def record(self, url, text, links, frontier, pending=[]):
+        self.log.write(json.dumps({'url': url, 'text': text, 'links': links},
+                                  ensure_ascii=False) + '\n')
+        self.log.flush()
+        self.since_save += 1
+        if self.since_save >= self.interval:
+            self.save(frontier, pending)
+
+    def save(self, frontier, pending=[]):
+        save_json_atomic(frontier.get_state(pending), self.frontier_file)
+        self.since_save = 0
+
+    def close(self, frontier):
+        self.save(frontier)
+        if self.log is not None:
+            self.log.close()
+
+#------------------------------------------------------------------------------------------
+
+# Per-host politeness: at most <concurrency> requests in flight to the same
+# host and at least <delay> seconds between the start of two requests to it.
+
+class HostThrottle:
+
+    def __init__(self, concurrency=4, delay=0.0):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.next_times = {}
+
+    def host_semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.concurrency)
+            return self.semaphores[host]
+
+    # Reserves the next start time for <host> and sleeps until it is reached.
+
+    def wait_turn(self, host):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_times.get(host, now))
+            self.next_times[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+    @contextmanager
+    def slot(self, url):
+        host = urlparse(url).netloc
+        with self.host_semaphore(host):
+            self.wait_turn(host)
+            yield
+
+#------------------------------------------------------------------------------------------
+
+# Fetches a page once and returns its clean text and its internal links.
+# A page that cannot be fetched has neither (see get_url_response); other
+# errors propagate, so the row is logged as failed rather than cut short.
+
+def crawl_page (url, root_url, throttle, fetcher=None):
+    with throttle.slot(url):
+        content = get_url_data(url, fetcher)
+    text, urls = extract_content(content)
+    text = clean_text(text)
+    urls = make_full_urls(urls, root_url)
+    return text, [u for u in urls if internal_link_p(u, root_url)]
+
+#------------------------------------------------------------------------------------------
+
+# Keeps up to <workers> pages in flight, subject to the per-host limits of
+# <host_concurrency> and <delay>, and yields [url, text] for each page as it
+# completes. New pages are only submitted when the consumer asks for the
+# next result, so a slow consumer slows the crawl down instead of letting
+# results pile up. <frontier> defaults to a depth-first CrawlFrontier; pass
+# one to choose BFS, a priority or a Bloom filter. <fetcher> defaults to the
+# shared Fetcher, whose pool_maxsize should be at least <host_concurrency>
+# to keep one connection per in-flight request. With a <checkpoint>
+# directory, crawl state is saved there as the crawl goes (see
+# CrawlCheckpoint) and <resume> continues a previous crawl, first yielding
+# the pages it had already crawled.
+
+def iter_crawl_website (root_url, limit=5000, workers=8, host_concurrency=4, delay=0.0,
+                        frontier=None, fetcher=None, checkpoint=None, resume=False,
+                        checkpoint_interval=100):
     print ('\nCrawling website: ' + root_url)
-    urlcomps = urlparse(root_url)
-    processed = []
-    remaining = [root_url]
-    results = []
+    throttle = HostThrottle(host_concurrency, delay)
+    if frontier is None:
+        frontier = CrawlFrontier()
     page_count = 0
-    while remaining and not limit_reached_p (page_count, limit):
-        url = remaining.pop()
-        if url not in processed:
-            if page_count%250==0:
-                print ('Website pages visited: ' + str(page_count))
-            page_count += 1
-            
-            text = extract_clean_text(url)
-            # print ('URL: ', url)
-            # print ('Text: '+ str(len(text)))
-            # print ('Chars: ' + str(list(map (len, text))))
-                   
-            results.append ([url, text])
-            processed.append(url)
-            
-            urls = extract_full_urls(url, root_url, filter='')
-            #print ('Urls count: ' + str(len(urls)))
-            next_urls = [u for u in urls if internal_link_p(u, root_url)]
-            #print ('Next Urls count: ' + str(len(next_urls)))
-            remaining += next_urls
-            
+    if checkpoint is not None:
+        checkpoint = CrawlCheckpoint(checkpoint, checkpoint_interval)
+        if resume:
+            for result in checkpoint.load(frontier):
+                page_count += 1
+                yield result
+            print ('Resuming after pages: ' + str(page_count))
+        checkpoint.open(resume)
+    frontier.add(root_url)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while frontier or pending:
+            while frontier and len(pending) < workers and not limit_reached_p (page_count, limit):
+                url = frontier.pop()
+                if page_count%250==0:
+                    print ('Website pages visited: ' + str(page_count))
+                page_count += 1
+                pending[executor.submit(crawl_page, url, root_url, throttle, fetcher)] = url
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                text, next_urls = future.result()
+                frontier.extend(next_urls)
+                if checkpoint is not None:
+                    checkpoint.record(url, text, next_urls, frontier, pending.values())
+                yield [url, text]
+    if checkpoint is not None:
+        checkpoint.close(frontier)
     print ('Website pages: ', str(page_count))
-    return results, page_count
+
+#------------------------------------------------------------------------------------------
+
+# Returns the [url, text] results of iter_crawl_website as a list, with the
+# number of pages visited.
+
+def crawl_website (root_url, limit=5000, workers=8, host_concurrency=4, delay=0.0,
+                   frontier=None, fetcher=None, checkpoint=None, resume=False,
+                   checkpoint_interval=100):
+    results = list(iter_crawl_website(root_url, limit, workers, host_concurrency, delay,
+                                      frontier, fetcher, checkpoint, resume,
+                                      checkpoint_interval))
+    return results, len(results)
 
 #------------------------------------------------------------------------------------------
 
@@ -424,54 +1535,327 @@ def print_processing_msg (row):
  
 #------------------------------------------------------------------------------------------
 
+# <rows> is a row count, or a list of rows.
+
 def print_totals_msg (rows, page_count):
+    if isinstance(rows, list):
+        rows = len(rows)
     print ("----------------------------------------------------------------------")
     print ("Website pages visited: " + str(page_count))
-    print ("Website rows generated: " + str(len(rows)))
+    print ("Website rows generated: " + str(rows))
     print ("----------------------------------------------------------------------")
  
 #------------------------------------------------------------------------------------------
 
-def print_all_totals_msg (all_rows, total_pages):
+# <total_rows> is a row count, or a list of rows.
+
+def print_all_totals_msg (total_rows, total_pages):
+    if isinstance(total_rows, list):
+        total_rows = len(total_rows)
     print ("----------------------------------------------------------------------")
     print ("Total pages visited: " + str(total_pages))
-    print ("Total rows processed: " + str(len(all_rows)))
+    print ("Total rows processed: " + str(total_rows))
     print ("----------------------------------------------------------------------")
 
 #------------------------------------------------------------------------------------------
 # PROCESS SINGLE ROW
 #------------------------------------------------------------------------------------------
 
-def process_website_row (row, limit=2000):
+#------------------------------------------------------------------------------------------
+# Streaming Pipeline
+#------------------------------------------------------------------------------------------
+
+# Each stage is a generator: fetch -> parse -> clean -> filter -> output row.
+# Only the page being processed is held in memory.
+
+def iter_clean_text (text):
+    for x in text:
+        x = clean_sentence(x)
+        if len(x.split(' ')) > 1:
+            yield x
 
+#------------------------------------------------------------------------------------------
+
+def iter_output_rows (sentences, row, url):
+    for s in sentences:
+        if len(s) > ct.MIN_SENTENCE_LEN:
+            yield make_output_row(s, row, url)
+
+#------------------------------------------------------------------------------------------
+
+# Yields the output rows of one row of the websites file: its page, then the
+# pages it links to or the pages of its website, as requested by the row.
+# The number of pages visited is kept in stats['pages'].
+
+def iter_website_rows (row, stats, limit=2000, checkpoint=None, resume=False):
+    # Scrape specified url page
+    url = row['url']
+    root_url = make_domain_url(url)
+    stats['pages'] = 1
+    # The page is fetched and parsed once for both its text and its links.
+    text, links = extract_content(get_url_data(url))
+    yield from iter_output_rows(iter_clean_text(text), row, url)
+    # Follow or crawl if requested
+    follow = row['follow_links']
+    crawl = row['crawl_website']
+
+    if follow.lower()=='yes':
+        print ('Following links...')
+        links = [u for u in make_full_urls(links, root_url) if internal_link_p(u, root_url)]
+        stats['pages'] += len(links)
+        for link in links:
+            print ('Following: ' + str(link))
+            yield from iter_output_rows(iter_clean_text(extract_text(link)), row, url)
+    elif crawl.lower()=='yes':
+        stats['pages'] = 0
+        for page_url, sentences in iter_crawl_website(root_url, limit=limit, checkpoint=checkpoint,
+                                                      resume=resume):
+            stats['pages'] += 1
+            yield from iter_output_rows(sentences, row, page_url)
+
+#------------------------------------------------------------------------------------------
+# PROCESS SINGLE ROW
+#------------------------------------------------------------------------------------------
+
+# Scrapes one row of the websites file. Errors are raised to the caller.
+# With a <checkpoint> directory a crawl can be resumed (see crawl_website).
+
+def scrape_website_row (row, limit=2000, checkpoint=None, resume=False):
+    stats = {}
+    rows = list(iter_website_rows(row, stats, limit, checkpoint, resume))
+    # Return the list of scraped sentences
+    return rows, stats['pages']
+
+#------------------------------------------------------------------------------------------
+
+# Appends one JSON line per failed row to <failure_log>.
+
+def log_row_failure (failure_log, count, row, error):
+    import traceback
+    print ('Error processing row ' + str(count) + ': ' + repr(error))
+    if failure_log is not None:
+        entry = {'row': count, 'url': str(row['url']), 'error': repr(error),
+                 'traceback': traceback.format_exc(), 'time': time.time()}
+        with open(failure_log, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+#------------------------------------------------------------------------------------------
+
+# Runs scrape_website_row for row number <count> and returns (rows,
+# page_count, ok). Failures are logged and return no rows. With a
+# <checkpoint_dir>, the crawl state of the row is kept in row_<count>/ under it.
+
+def row_checkpoint_pathname (checkpoint_dir, count):
+    if checkpoint_dir is None:
+        return None
+    return os.path.join(checkpoint_dir, 'row_' + str(count))
+
+def run_website_row (row, count=0, limit=2000, checkpoint_dir=None, resume=False,
+                     failure_log=None):
     try:
-        # Scrape specified url page
-        url = row['url']
-        root_url = make_domain_url(url)
-        text = extract_clean_text (url)
-        rows = make_output_rows(text, row, url)
-        page_count = 1
-        # Follow or crawl if requested
-        follow = row['follow_links']
-        crawl = row['crawl_website']
-    
-        if follow.lower()=='yes':
-            print ('Following links...')
-            links = extract_internal_urls(url, root_url) 
-            for link in links:
-                print ('Following: ' + str(link))
-                text = extract_clean_text(link)
-                rows += make_output_rows(text, row, url)
-            page_count += len(links)
-        elif crawl.lower()=='yes':
-            results, page_count = crawl_website(root_url, limit=2000)
-            rows += process_crawler_results(results, row)
-    
-        # Return the list of scraped sentences
-        return rows, page_count
-    except Exception:
-        return [], 0
-    
+        rows, page_count = scrape_website_row(row, limit, row_checkpoint_pathname(checkpoint_dir, count),
+                                              resume)
+        return rows, page_count, True
+    except Exception as e:
+        log_row_failure(failure_log, count, row, e)
+        return [], 0, False
+
+#------------------------------------------------------------------------------------------
+
+def process_website_row (row, limit=2000, failure_log=None):
+    rows, page_count, ok = run_website_row(row, limit=limit, failure_log=failure_log)
+    return rows, page_count
+
+#------------------------------------------------------------------------------------------
+
+# Streaming version of run_website_row: the output rows are passed to
+# <write> in batches of <batch_size> as they are produced, and (row_count,
+# page_count, ok) is returned. Rows written before a failure stay written;
+# a resumed run discards them (see SentenceSink.discard).
+
+def stream_website_row (row, write, count=0, limit=2000, checkpoint_dir=None, resume=False,
+                        failure_log=None, batch_size=1000):
+    stats = {'pages': 0}
+    row_count = 0
+    batch = []
+    try:
+        for output_row in iter_website_rows(row, stats, limit,
+                                             row_checkpoint_pathname(checkpoint_dir, count),
+                                             resume):
+            batch.append(output_row)
+            if len(batch) >= batch_size:
+                write(batch)
+                row_count += len(batch)
+                batch = []
+        if batch:
+            write(batch)
+            row_count += len(batch)
+        return row_count, stats['pages'], True
+    except Exception as e:
+        log_row_failure(failure_log, count, row, e)
+        return row_count, stats['pages'], False
+
+#------------------------------------------------------------------------------------------
+# Row Checkpoints
+#------------------------------------------------------------------------------------------
+
+# Records, in <checkpoint_dir>/rows.json, the websites whose sentences have
+# been written to the sink, with their row and page counts.
+
+class RowCheckpoint:
+
+    def __init__(self, checkpoint_dir, resume=False):
+        self.pathname = None
+        self.completed = {}
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            self.pathname = os.path.join(checkpoint_dir, 'rows.json')
+            if resume and os.path.isfile(self.pathname):
+                with open(self.pathname, 'r', encoding='utf-8') as f:
+                    self.completed = json.load(f)
+
+    def completed_p(self, count):
+        return str(count) in self.completed
+
+    def mark(self, count, row_count, page_count):
+        self.completed[str(count)] = [row_count, page_count]
+        if self.pathname is not None:
+            save_json_atomic(self.completed, self.pathname)
+
+    def total_rows(self):
+        return sum([c[0] for c in self.completed.values()])
+
+    def total_pages(self):
+        return sum([c[1] for c in self.completed.values()])
+
+#------------------------------------------------------------------------------------------
+
+# Closes a website whose rows have all been written to <sink>. Only websites
+# that did not fail are finished and marked completed; the partial rows of
+# a failed one are dropped from the sink, as a failed row contributes
+# nothing, and a resumed run retries it.
+
+def finish_website_row (sink, checkpoint, count, row_count, page_count, ok):
+    if ok:
+        print_totals_msg (row_count, page_count)
+        sink.finish (count)
+        checkpoint.mark(count, row_count, page_count)
+    else:
+        sink.drop (count)
+
+#------------------------------------------------------------------------------------------
+# Process Rows in Parallel
+#------------------------------------------------------------------------------------------
+
+# Worker side: streams the rows of one website into <queue> as
+# ('start', count, None), then ('rows', count, batch) messages and finally
+# ('done', count, totals).
+
+def stream_website_row_to_queue (queue, row, count, limit=2000, checkpoint_dir=None,
+                                 resume=False, failure_log=None, batch_size=1000):
+    queue.put(('start', count, None))
+    write = lambda batch: queue.put(('rows', count, batch))
+    totals = stream_website_row(row, write, count, limit, checkpoint_dir, resume,
+                                failure_log, batch_size)
+    queue.put(('done', count, totals))
+
+#------------------------------------------------------------------------------------------
+
+# Runs the rows numbered <counts> of <rows> on one pool of <workers>
+# processes, writing their batches to <sink> as they arrive. A worker that
+# exits hard breaks the pool and every row still outstanding with it: the
+# partial rows of those are dropped from the sink and they are returned
+# as {count: error}, with the set of rows that had started.
+
+def run_website_rows_pool (queue, rows, counts, sink, checkpoint, stats, workers=4,
+                           initializer=None, initargs=(), checkpoint_dir=None, resume=False,
+                           failure_log=None):
+    import queue as queues
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    started, lost = set(), {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=initargs) as executor:
+        futures = {}
+        for count in counts:
+            future = executor.submit(stream_website_row_to_queue, queue, rows[count], count,
+                                     2000, checkpoint_dir, resume, failure_log)
+            futures[future] = count
+        remaining = set(counts)
+        while remaining:
+            try:
+                kind, count, payload = queue.get(timeout=1)
+            except queues.Empty:
+                # Workers that died never send 'done'
+                for future, count in futures.items():
+                    if count in remaining and future.done() and future.exception() is not None:
+                        remaining.discard(count)
+                        if isinstance(future.exception(), BrokenProcessPool):
+                            sink.drop (count)
+                            lost[count] = future.exception()
+                        else:
+                            log_row_failure(failure_log, count, rows[count], future.exception())
+                            finish_website_row (sink, checkpoint, count, 0, 0, False)
+                continue
+            if kind == 'start':
+                started.add(count)
+            elif kind == 'rows':
+                sink.write (payload, count)
+            else:
+                remaining.discard(count)
+                stats['completed'] += 1
+                print ('\nRows completed: ' + str(stats['completed']) + '/' +
+                       str(stats['rows']) + ' (' + str(rows[count]['url']) + ')')
+                finish_website_row (sink, checkpoint, count, *payload)
+    # The pool's processes have exited: drop what lost rows left in the queue.
+    while lost:
+        try:
+            queue.get_nowait()
+        except queues.Empty:
+            break
+    return lost, started
+
+#------------------------------------------------------------------------------------------
+
+# Spreads the rows of <df> across a pool of <workers> processes. Workers
+# stream their output rows in batches through a queue bounded to
+# <queue_size> batches, so a slow sink makes workers wait rather than
+# buffer. Batches are written to <sink> under the same row number a serial
+# run would use. A row that fails is logged and does not stop the others.
+# A worker that dies breaks the pool: the rows that had not started yet go
+# to a fresh pool, and those that were running are retried one per pool,
+# so only the row that kills its worker again is logged as failed. Rows
+# already completed in <checkpoint> are skipped.
+
+def process_website_rows_parallel (df, sink, checkpoint, workers=4, cache_file=None,
+                                   offline=False, checkpoint_dir=None, resume=False,
+                                   failure_log=None, queue_size=None):
+    import multiprocessing
+    initializer, initargs = None, ()
+    if cache_file is not None:
+        initializer, initargs = use_response_cache, (cache_file, None, None, offline)
+    rows = {}
+    for count, (index, row) in enumerate(df.iterrows()):
+        if not checkpoint.completed_p(count):
+            rows[count] = row
+    stats = {'rows': len(rows), 'completed': 0}
+    options = {'initializer': initializer, 'initargs': initargs,
+               'checkpoint_dir': checkpoint_dir, 'resume': resume, 'failure_log': failure_log}
+    with multiprocessing.Manager() as manager:
+        queue = manager.Queue(maxsize=queue_size or workers * 4)
+        todo = list(rows.keys())
+        while todo:
+            lost, started = run_website_rows_pool(queue, rows, todo, sink, checkpoint, stats,
+                                                  workers, **options)
+            running = [c for c in lost if c in started] or list(lost.keys())
+            todo = [c for c in lost if c not in running]
+            for count in running:
+                crashed, _ = run_website_rows_pool(queue, rows, [count], sink, checkpoint,
+                                                   stats, 1, **options)
+                if crashed:
+                    log_row_failure(failure_log, count, rows[count], crashed[count])
+                    finish_website_row (sink, checkpoint, count, 0, 0, False)
+
 #------------------------------------------------------------------------------------------
 # Process Websites File
 #------------------------------------------------------------------------------------------
@@ -491,25 +1875,211 @@ sentences_file = 'website_sentences.xlsx'
 #               'year', 'type'
 #
 # Output columns: 'text', 'classification', 'url', 'type'
-
-def process_websites_file (list_file=list_file, sentences_file=sentences_file):
+#
+# With a <cache_file>, pages are served from an on-disk ResponseCache so that
+# re-processing runs do not download them again. <offline> replays the cache
+# only and does no network I/O at all.
+#
+# With <workers> greater than 1, rows are processed by a process pool.
+#
+# Rows flow from fetch to sink through generators (see iter_website_rows),
+# so memory does not grow with the size of a website.
+#
+# <sink> selects where sentences are written as they are produced:
+# 'excel' (per-website shards, then merge_websites_files), or a single
+# 'jsonl', 'csv' or 'sqlite' store named after <sentences_file>. With
+# <export_excel>, a store is also exported to <sentences_file> at the end.
+#
+# With a <checkpoint_dir>, completed websites and the state of each crawl
+# are saved there, and <resume> restarts an interrupted run where it
+# stopped: completed websites are skipped and crawls continue without
+# fetching their pages again. Failed rows are logged to <failure_log>,
+# by default failures.jsonl in <checkpoint_dir>.
+
+def process_websites_file (list_file=list_file, sentences_file=sentences_file,
+                           cache_file=None, offline=False, workers=1,
+                           sink='excel', export_excel=False,
+                           checkpoint_dir=None, resume=False, failure_log=None):
     print ('\nProcessing websites file: ' + list_file)
+    if cache_file is not None:
+        use_response_cache (cache_file, offline=offline)
+    if failure_log is None and checkpoint_dir is not None:
+        failure_log = os.path.join(checkpoint_dir, 'failures.jsonl')
     df = load_websites_file (list_file)
-    all_rows =  []
-    count = 0
-    total_pages = 0
-    for index, row in df.iterrows():
-        rows, page_count = process_website_row (row)
-        total_pages += page_count
-        print_totals_msg (rows, page_count)
-        save_website_sentences (rows, sentences_file, count=count)
-        count += 1
-        all_rows += rows
-    #df = save_websites_sentences (all_rows, sentences_file)
-    print_all_totals_msg (all_rows, total_pages)
-    merge_websites_files()
+    checkpoint = RowCheckpoint (checkpoint_dir, resume)
+    resume = resume and checkpoint_dir is not None
+    with make_sentence_sink (sink, sentences_file, append=resume) as output:
+        if resume:
+            output.discard ([int(c) for c in checkpoint.completed])
+            print ('Resuming after websites: ' + str(len(checkpoint.completed)))
+        if workers > 1:
+            process_website_rows_parallel (df, output, checkpoint, workers, cache_file,
+                                           offline, checkpoint_dir, resume, failure_log)
+        else:
+            count = 0
+            for index, row in df.iterrows():
+                if not checkpoint.completed_p(count):
+                    write = lambda batch: output.write(batch, count)
+                    totals = stream_website_row (row, write, count, 2000, checkpoint_dir,
+                                                 resume, failure_log)
+                    finish_website_row (output, checkpoint, count, *totals)
+                count += 1
+    print_all_totals_msg (checkpoint.total_rows(), checkpoint.total_pages())
+    if sink == 'excel':
+        merge_websites_files()
+    elif export_excel:
+        export_sentence_store_to_excel (output.pathname, sentences_file)
     return df
 
+#-----------------------------------------------------------------------------------------
+# Benchmarks
+#-----------------------------------------------------------------------------------------
+
+# A local stand-in for a website: <pages> generated pages, each with a few
+# paragraphs and <links> internal links, served with <latency> seconds of delay.
+
+def make_benchmark_page (n, pages, links):
+    body = ''.join(['<p>Page number ' + str(n) + ' paragraph ' + str(i) +
+                    ' describes the benchmark website content.</p>' for i in range(5)])
+    hrefs = ''.join(['<a href="/page/' + str((n * links + i + 1) % pages) + '">link</a>'
+                     for i in range(links)])
+    return ('<html><body>' + body + hrefs + '</body></html>').encode('utf-8')
+
+#-----------------------------------------------------------------------------------------
+
+def start_benchmark_server (pages=200, links=5, latency=0.02):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            try:
+                n = int(self.path.rstrip('/').split('/')[-1])
+            except ValueError:
+                n = 0
+            content = make_benchmark_page(n % pages, pages, links)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+#-----------------------------------------------------------------------------------------
+
+# Compares crawl times for each worker count against the local server.
+
+def benchmark_crawl (pages=200, links=5, latency=0.02, workers=[1, 4, 8, 16]):
+    from tabulate import tabulate
+    server = start_benchmark_server(pages, links, latency)
+    root_url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+    table = []
+    try:
+        for n in workers:
+            start = time.perf_counter()
+            results, page_count = crawl_website(root_url, limit=pages, workers=n,
+                                                host_concurrency=n)
+            elapsed = time.perf_counter() - start
+            table.append([n, page_count, round(elapsed, 2), round(page_count / elapsed, 1)])
+    finally:
+        server.shutdown()
+    print (tabulate(table, headers=['workers', 'pages', 'seconds', 'pages/sec']))
+    return table
+
+# Times the former tokenizer (stopword list scan and re.match per token)
+# against clean_sentences, serial and with <workers> processes, on a list of
+# scraped sentences, e.g. load_websites_sentences()['text'].
+
+def benchmark_tokenization (sentences, workers=4, repeat=3):
+    import nltk
+    from tabulate import tabulate
+    stopWords = get_stopwords()
+    sentences = [str(s) for s in sentences]
+
+    def list_clean_sentence (s):
+        tokens = [t for t in nltk.word_tokenize(s.lower())
+                  if t not in stopWords and re.match(r'[^\W\d]*$', t) is not None]
+        return ' '.join(tokens)
+
+    expected = [list_clean_sentence(s) for s in sentences]
+    runs = [['list lookup', lambda: [list_clean_sentence(s) for s in sentences]],
+            ['clean_sentences', lambda: clean_sentences(sentences)],
+            ['clean_sentences x' + str(workers), lambda: clean_sentences(sentences, workers)]]
+    table = []
+    for name, fn in runs:
+        start = time.perf_counter()
+        for i in range(repeat):
+            result = fn()
+        elapsed = (time.perf_counter() - start) / repeat
+        table.append([name, len(sentences), round(elapsed, 3),
+                      round(len(sentences) / elapsed, 1) if elapsed else 0,
+                      result == expected])
+    print (tabulate(table, headers=['tokenizer', 'sentences', 'seconds', 'sentences/sec', 'identical']))
+    return table
+
+#-----------------------------------------------------------------------------------------
+
+# Compares CPU time and peak Python heap of the extraction paths over a
+# directory of saved HTML pages. 'two-parse' is the former path, which built
+# one full tree for the text and another for the links. tracemalloc does not
+# see libxml2's own allocations, so the lxml figure is a lower bound.
+
+def benchmark_extraction (html_dir, repeat=3):
+    import tracemalloc
+    from bs4 import BeautifulSoup
+    from tabulate import tabulate
+    files = [os.path.join(html_dir, f) for f in os.listdir(html_dir)
+             if f.endswith('.html') or f.endswith('.htm')]
+    pages = []
+    for f in files:
+        with open(f, 'rb') as fp:
+            pages.append(fp.read())
+    engines = [['two-parse', lambda c: (soup_text(BeautifulSoup(c, 'lxml')),
+                                        soup_urls(BeautifulSoup(c, 'lxml')))],
+               ['soup-strainer', lambda c: extract_content(c)],
+               ['lxml', lambda c: extract_content(c, engine='lxml')]]
+    table = []
+    for name, fn in engines:
+        start = time.process_time()
+        for i in range(repeat):
+            for c in pages:
+                fn(c)
+        elapsed = (time.process_time() - start) / repeat
+        tracemalloc.start()
+        for c in pages:
+            fn(c)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        table.append([name, len(pages), round(elapsed, 3),
+                      round(len(pages) / elapsed, 1) if elapsed else 0,
+                      round(peak / 1048576, 2)])
+    print (tabulate(table, headers=['engine', 'pages', 'cpu seconds', 'pages/sec', 'peak MB']))
+    return table
+
+# Import time of each module in a fresh interpreter, best of <repeat>.
+
+def benchmark_import (modules=['scraper', 'files'], repeat=5):
+    import subprocess
+    from tabulate import tabulate
+    code = 'import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)'
+    table = []
+    for module in modules:
+        times = []
+        for i in range(repeat):
+            output = subprocess.run([sys.executable, '-c', code.format(module)],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True).stdout
+            times.append(float(output))
+        table.append([module, round(min(times) * 1000, 1)])
+    print (tabulate(table, headers=['module', 'import ms']))
+    return table
+
 #-----------------------------------------------------------------------------------------
 # Main Function
 #-----------------------------------------------------------------------------------------
@@ -1,3 +1,16 @@
+#------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------
+
+# Heavy dependencies (numpy, scipy) are imported by the functions that
+# use them.
+
+import zlib
+import heapq
+import pickle
+import random
+import time
+
 
 #************************************************************************
 # Part 1: Jaccard Index & Distance Matrices
@@ -19,9 +32,463 @@ def jaccard_index (l1, l2):
 
 #------------------------------------------------------------------------
 
+# <matrix> is either a square matrix or a condensed upper triangle as
+# returned by build_jaccard_matrix(..., condensed=True).
+
 def get_jaccard_distance (e1, e2, matrix, indices):
+    if getattr(matrix, 'ndim', 2) == 1:
+        return condensed_value(matrix, len(indices), indices[e1], indices[e2])
     return matrix[indices[e1]][indices[e2]]
 
+#------------------------------------------------------------------------
+# Jaccard Matrices
+#------------------------------------------------------------------------
+
+# Sparse binary entity x token matrix (CSR, float32) for <token_lists>.
+
+def make_token_matrix (token_lists):
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    vocabulary = {}
+    indptr = [0]
+    columns = []
+    for tokens in token_lists:
+        columns.extend([vocabulary.setdefault(t, len(vocabulary)) for t in set(tokens)])
+        indptr.append(len(columns))
+    data = np.ones(len(columns), dtype=np.float32)
+    return csr_matrix((data, columns, indptr), shape=(len(token_lists), len(vocabulary)))
+
+#------------------------------------------------------------------------
+
+# Position of (i, j) in a condensed upper triangle of an n x n matrix.
+
+def condensed_position (n, i, j):
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+def condensed_value (condensed, n, i, j):
+    if i == j:
+        return 100.0
+    return condensed[condensed_position(n, i, j)]
+
+#------------------------------------------------------------------------
+
+# Jaccard indices (percent, as jaccard_index) of every pair of entities.
+# <entities> is a dict of entity -> tokens, or a list of entities with
+# their <token_lists>. Intersections come from one sparse product per
+# block of <chunk_size> rows, so only a chunk_size x n block is dense at a
+# time. With <output_file> the result is a float32 np.memmap (reopen it with
+# load_jaccard_matrix); with <condensed> only the upper triangle is kept.
+# Returns the matrix and the entity -> index map.
+
+def build_jaccard_matrix (entities, token_lists=None, condensed=False,
+                          chunk_size=1000, output_file=None):
+    import numpy as np
+    if token_lists is None:
+        token_lists = list(entities.values())
+        entities = list(entities.keys())
+    indices = dict([(e, i) for i, e in enumerate(entities)])
+    n = len(entities)
+    X = make_token_matrix(token_lists)
+    XT = X.T.tocsr()
+    sizes = np.diff(X.indptr).astype(np.float32)
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    if output_file is not None:
+        matrix = np.memmap(output_file, dtype=np.float32, mode='w+', shape=shape)
+        save_jaccard_matrix_index(output_file, entities, condensed)
+    else:
+        matrix = np.empty(shape, dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        intersections = (X[start:stop] @ XT).toarray()
+        unions = sizes[start:stop, None] + sizes[None, :] - intersections
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block = np.where(unions > 0, intersections * 100.0 / unions, 0).astype(np.float32)
+        if condensed:
+            for i in range(start, stop):
+                position = condensed_position(n, i, i + 1)
+                matrix[position : position + n - i - 1] = block[i - start, i + 1:]
+        else:
+            matrix[start:stop] = block
+    if output_file is not None:
+        matrix.flush()
+    return matrix, indices
+
+#------------------------------------------------------------------------
+
+def save_jaccard_matrix_index (output_file, entities, condensed):
+    import json
+    with open(output_file + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'entities': list(entities), 'condensed': condensed}, f)
+
+# Reopens a matrix written by build_jaccard_matrix as a read-only memmap.
+
+def load_jaccard_matrix (output_file):
+    import json
+    import numpy as np
+    with open(output_file + '.json', encoding='utf-8') as f:
+        info = json.load(f)
+    entities = info['entities']
+    n = len(entities)
+    shape = (n * (n - 1) // 2,) if info['condensed'] else (n, n)
+    matrix = np.memmap(output_file, dtype=np.float32, mode='r', shape=shape)
+    return matrix, dict([(e, i) for i, e in enumerate(entities)])
+
+
+#************************************************************************
+# Part 2: Near-Duplicate Detection (MinHash & LSH)
+#************************************************************************
+
+#------------------------------------------------------------------------
+# MinHash Signatures
+#------------------------------------------------------------------------
+
+mersenne_prime = (1 << 61) - 1
+max_hash = (1 << 32) - 1
+
+# Returns the word k-grams of <text> (a string or a list of tokens). With
+# k=1 these are the words themselves, as compared by jaccard_index.
+
+def shingles (text, k=1):
+    tokens = text.split() if isinstance(text, str) else list(text)
+    if k == 1:
+        return set(tokens)
+    return set([' '.join(tokens[i : i + k]) for i in range(len(tokens) - k + 1)])
+
+#------------------------------------------------------------------------
+
+# <num_perm> random hash functions (a * x + b) mod p, shared by every
+# signature built with the same seed.
+
+def make_permutations (num_perm=128, seed=1):
+    import numpy as np
+    rng = random.Random(seed)
+    a = np.array([rng.randint(1, max_hash) for i in range(num_perm)], dtype=np.uint64)
+    b = np.array([rng.randint(0, max_hash) for i in range(num_perm)], dtype=np.uint64)
+    return a, b
+
+#------------------------------------------------------------------------
+
+# Token hashes are CRC32, stable across processes (unlike hash()).
+
+def minhash_signature (tokens, permutations):
+    import numpy as np
+    a, b = permutations
+    if len(tokens) == 0:
+        return np.full(len(a), max_hash, dtype=np.uint64)
+    hashes = np.array([zlib.crc32(t.encode('utf-8')) for t in tokens], dtype=np.uint64)
+    values = (np.outer(hashes, a) + b) % mersenne_prime & max_hash
+    return values.min(axis=0)
+
+#------------------------------------------------------------------------
+
+# Estimated Jaccard index of two signatures, in percent like jaccard_index.
+
+def minhash_jaccard_index (sig1, sig2):
+    return float((sig1 == sig2).mean()) * 100.0
+
+#------------------------------------------------------------------------
+# Locality-Sensitive Hashing
+#------------------------------------------------------------------------
+
+# Picks the number of bands b and rows per band r (b * r <= num_perm) whose
+# S-curve threshold (1/b)^(1/r) is closest to <threshold> percent.
+
+def lsh_bands (threshold, num_perm):
+    target = threshold / 100.0
+    best = None
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        error = abs((1.0 / b) ** (1.0 / r) - target)
+        if best is None or error < best[0]:
+            best = [error, b, r]
+    return best[1], best[2]
+
+#------------------------------------------------------------------------
+
+# MinHash LSH index. Sets whose Jaccard index is above <threshold> percent
+# collide in at least one band with high probability, so a query only
+# compares against a few candidates instead of every indexed set.
+
+class MinHashLSH:
+
+    def __init__(self, threshold=80, num_perm=128, seed=1):
+        self.threshold = threshold
+        self.permutations = make_permutations(num_perm, seed)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.tables = [{} for i in range(self.bands)]
+        self.signatures = {}
+
+    def signature(self, tokens):
+        return minhash_signature(tokens, self.permutations)
+
+    def band_keys(self, sig):
+        r = self.rows
+        return [sig[i * r : (i + 1) * r].tobytes() for i in range(self.bands)]
+
+    def insert(self, key, tokens=None, sig=None):
+        if sig is None:
+            sig = self.signature(tokens)
+        self.signatures[key] = sig
+        for table, band in zip(self.tables, self.band_keys(sig)):
+            table.setdefault(band, []).append(key)
+
+    # Keys of indexed sets whose estimated Jaccard index with <tokens> is at
+    # least the threshold.
+
+    def query(self, tokens=None, sig=None):
+        if sig is None:
+            sig = self.signature(tokens)
+        candidates = set()
+        for table, band in zip(self.tables, self.band_keys(sig)):
+            candidates.update(table.get(band, []))
+        return [k for k in candidates
+                if minhash_jaccard_index(sig, self.signatures[k]) >= self.threshold]
+
+    def __len__(self):
+        return len(self.signatures)
+
+#------------------------------------------------------------------------
+# Near-Duplicate Filter
+#------------------------------------------------------------------------
+
+# Yields the items of <items> that are not near-duplicates (Jaccard index
+# of their shingles at least <threshold> percent) of an item already
+# yielded. <key> maps an item to its text or tokens, e.g. lambda row: row[1]
+# for scraper output rows.
+
+def near_duplicate_filter (items, threshold=80, num_perm=128, k=1, key=None, seed=1):
+    lsh = MinHashLSH(threshold, num_perm, seed)
+    for item in items:
+        tokens = shingles(item if key is None else key(item), k)
+        sig = lsh.signature(tokens)
+        if not lsh.query(sig=sig):
+            lsh.insert(len(lsh), sig=sig)
+            yield item
+
+#------------------------------------------------------------------------
+
+def remove_near_duplicates (items, threshold=80, num_perm=128, k=1, key=None):
+    return list(near_duplicate_filter(items, threshold, num_perm, k, key))
+
+#************************************************************************
+# Part 3: Similarity Search
+#************************************************************************
+
+#------------------------------------------------------------------------
+# Inverted Similarity Index
+#------------------------------------------------------------------------
+
+# Inverted index (token -> posting list of set ids) answering top-k and
+# threshold Jaccard queries without scanning every set. Query tokens are
+# probed rarest first; after p of the n query tokens, a set not yet seen
+# shares at most n - p of them, so its Jaccard index is at most (n - p) / n
+# and the probe stops once that falls below the threshold or the current
+# k-th best score (prefix filtering, as in AllPairs/PPJoin). Candidates
+# whose size rules out the bound are skipped before verification (size
+# filtering). Scores are in percent, as jaccard_index. Sets can be added at
+# any time.
+
+class SimilarityIndex:
+
+    def __init__(self):
+        self.token_ids = {}
+        self.postings = []
+        self.sets = []
+        self.keys = []
+
+    def __len__(self):
+        return len(self.sets)
+
+    def add(self, key, tokens):
+        set_id = len(self.sets)
+        ids = []
+        for token in set(tokens):
+            token_id = self.token_ids.get(token)
+            if token_id is None:
+                token_id = self.token_ids[token] = len(self.postings)
+                self.postings.append([])
+            self.postings[token_id].append(set_id)
+            ids.append(token_id)
+        self.sets.append(frozenset(ids))
+        self.keys.append(key)
+        return set_id
+
+    def add_all(self, items):
+        for key, tokens in items:
+            self.add(key, tokens)
+
+    # Returns [(key, score), ...] by decreasing score: the <k> most similar
+    # sets if k is given, otherwise every set scoring at least <threshold>.
+
+    def search(self, tokens, k=None, threshold=0):
+        tokens = set(tokens)
+        n = len(tokens)
+        if n == 0:
+            return []
+        known = [self.token_ids[t] for t in tokens if t in self.token_ids]
+        known.sort(key=lambda token_id: len(self.postings[token_id]))
+        query = frozenset(known)
+        minimum = threshold / 100.0
+        results = []
+        seen = set()
+        for p, token_id in enumerate(known):
+            if k is not None and len(results) == k:
+                limit = max(minimum, results[0][0])
+            else:
+                limit = minimum
+            if (n - p) / n < limit:
+                break
+            smallest = limit * n
+            largest = n / limit if limit > 0 else float('inf')
+            for set_id in self.postings[token_id]:
+                if set_id in seen:
+                    continue
+                seen.add(set_id)
+                candidate = self.sets[set_id]
+                size = len(candidate)
+                if size < smallest or size > largest:
+                    continue
+                overlap = len(query & candidate)
+                score = overlap / (n + size - overlap)
+                if score < minimum:
+                    continue
+                if k is None:
+                    results.append((score, set_id))
+                elif len(results) < k:
+                    heapq.heappush(results, (score, -set_id))
+                elif score > results[0][0]:
+                    heapq.heapreplace(results, (score, -set_id))
+        if k is not None:
+            results = [(score, -set_id) for score, set_id in results]
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return [(self.keys[set_id], score * 100.0) for score, set_id in results]
+
+    def top_k(self, tokens, k=20):
+        return self.search(tokens, k=k)
+
+    def above_threshold(self, tokens, threshold=80):
+        return self.search(tokens, threshold=threshold)
+
+    def save(self, file):
+        with open(file, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file):
+        index = cls()
+        with open(file, 'rb') as f:
+            index.__dict__.update(pickle.load(f))
+        return index
+
+
+#************************************************************************
+# Part 4: Benchmarks
+#************************************************************************
+
+#------------------------------------------------------------------------
+# Near-Duplicates
+#------------------------------------------------------------------------
+
+# Compares near-duplicate pairs found by an exact all-pairs jaccard_index
+# pass with those found through the LSH index, on a list of sentences.
+
+def benchmark_near_duplicates (sentences, threshold=80, num_perm=128):
+    token_lists = [s.split() for s in sentences]
+
+    start = time.perf_counter()
+    exact = set()
+    for i in range(len(token_lists)):
+        for j in range(i + 1, len(token_lists)):
+            if jaccard_index(token_lists[i], token_lists[j]) >= threshold:
+                exact.add((i, j))
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lsh = MinHashLSH(threshold, num_perm)
+    found = set()
+    for i, tokens in enumerate(token_lists):
+        sig = lsh.signature(set(tokens))
+        for j in lsh.query(sig=sig):
+            found.add((j, i))
+        lsh.insert(i, sig=sig)
+    lsh_time = time.perf_counter() - start
+
+    true_positives = len(exact & found)
+    result = {'sentences': len(sentences),
+              'exact_seconds': round(exact_time, 3), 'lsh_seconds': round(lsh_time, 3),
+              'exact_pairs': len(exact), 'lsh_pairs': len(found),
+              'recall': true_positives / len(exact) if exact else 1.0,
+              'precision': true_positives / len(found) if found else 1.0}
+    for k, v in result.items():
+        print (k + ': ' + str(v))
+    return result
+
+#------------------------------------------------------------------------
+# Jaccard Matrices
+#------------------------------------------------------------------------
+
+# Times build_jaccard_matrix against a double loop over jaccard_index on
+# the first <sample> token lists, and checks they agree.
+
+def benchmark_jaccard_matrix (token_lists, sample=500, chunk_size=1000):
+    import numpy as np
+    token_lists = token_lists[:sample]
+    entities = list(range(len(token_lists)))
+
+    start = time.perf_counter()
+    exact = [[jaccard_index(l1, l2) for l2 in token_lists] for l1 in token_lists]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix, indices = build_jaccard_matrix(entities, token_lists, chunk_size=chunk_size)
+    sparse_time = time.perf_counter() - start
+
+    np.fill_diagonal(matrix, np.diag(np.array(exact)))
+    result = {'entities': len(entities),
+              'loop_seconds': round(loop_time, 3), 'sparse_seconds': round(sparse_time, 3),
+              'max_error': float(np.abs(matrix - np.array(exact)).max())}
+    for k, v in result.items():
+        print (k + ': ' + str(v))
+    return result
+
+#------------------------------------------------------------------------
+# Similarity Search
+#------------------------------------------------------------------------
+
+# Times top-k queries on a SimilarityIndex over <token_lists> against a
+# full scan with jaccard_index, and checks the top scores agree.
+
+def benchmark_similarity_index (token_lists, queries=100, k=20, seed=1):
+    index = SimilarityIndex()
+    start = time.perf_counter()
+    for i, tokens in enumerate(token_lists):
+        index.add(i, tokens)
+    build_time = time.perf_counter() - start
+    sample = random.Random(seed).sample(range(len(token_lists)), min(queries, len(token_lists)))
+
+    start = time.perf_counter()
+    found = [index.top_k(token_lists[i], k) for i in sample]
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = []
+    for i in sample:
+        scores = sorted([jaccard_index(token_lists[i], tokens) for tokens in token_lists], reverse=True)
+        exact.append([s for s in scores[:k] if s > 0])
+    scan_time = time.perf_counter() - start
+
+    mismatches = sum([1 for f, e in zip(found, exact)
+                      if [round(s, 6) for key, s in f] != [round(s, 6) for s in e]])
+    result = {'sets': len(token_lists), 'queries': len(sample),
+              'build_seconds': round(build_time, 3),
+              'index_ms_per_query': round(index_time * 1000 / len(sample), 3),
+              'scan_ms_per_query': round(scan_time * 1000 / len(sample), 3),
+              'mismatches': mismatches}
+    for key, v in result.items():
+        print (key + ': ' + str(v))
+    return result
 
 #------------------------------------------------------------------------
 # End of File